@@ -0,0 +1,112 @@
+"""
+Measures how many requests per second `SignatureAuth.authenticate` can sign
+and encode, compared with the previous implementation (kept below as
+`LegacySignatureAuth`), which serialized list params twice and mutated the
+params dict it was given.
+
+Usage:
+    python benchmarks/bench_auth.py [--seconds 2]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import six
+
+from six.moves.urllib import parse as url_parse
+from six.moves.urllib import request as url_request
+
+from mixpanel_query.auth import SignatureAuth
+from mixpanel_query.utils import _tobytes
+
+
+def legacy_unicode_urlencode(params):
+    if isinstance(params, dict):
+        params = list(six.iteritems(params))
+    for i, param in enumerate(params):
+        if isinstance(param[1], list):
+            params[i] = (param[0], json.dumps(param[1]),)
+    return url_parse.urlencode([(_tobytes(k), _tobytes(v)) for k, v in params])
+
+
+class LegacySignatureAuth(SignatureAuth):
+    " The signing and encoding code as it was before single-pass serialization. "
+
+    def _hash_args(self, args, secret=None):
+        for arg in args:
+            if isinstance(args[arg], list):
+                args[arg] = json.dumps(args[arg])
+
+        arg_strings = ["{}={}".format(arg, args[arg]) for arg in sorted(args.keys())]
+        hash = hashlib.md5(_tobytes(''.join(arg_strings)))
+        hash.update(_tobytes(secret or self.client.api_secret))
+        return hash.hexdigest()
+
+    def authenticate(self, url, params):
+        params['api_key'] = self.client.api_key
+        params['expire'] = int(time.time()) + self.DEFAULT_EXPIRATION
+        if 'sig' in params:
+            del params['sig']
+        params['sig'] = self._hash_args(params, self.client.api_secret)
+        return url_request.Request('{0}?{1}'.format(url, legacy_unicode_urlencode(params)))
+
+
+class Client(object):
+    api_key = u'0123456789abcdef0123456789abcdef'
+    api_secret = u'fedcba9876543210fedcba9876543210'
+
+
+def params():
+    return {
+        'event': ['signed up', 'logged in', 'viewed page', u'compr\xe9'],
+        'from_date': '2014-04-01',
+        'to_date': '2014-04-30',
+        'unit': 'day',
+        'on': 'properties["mp_country_code"]',
+        'where': '"guidebook" in properties["mp_keyword"]',
+        'limit': 100,
+        'type': 'unique',
+        'format': 'json',
+    }
+
+
+def run(auth, seconds):
+    url = 'https://mixpanel.com/api/2.0/segmentation/'
+    count = 0
+    started = time.time()
+    while time.time() - started < seconds:
+        for _ in range(1000):
+            auth.authenticate(url, params())
+        count += 1000
+    return count / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=2)
+    args = parser.parse_args()
+
+    legacy, current = LegacySignatureAuth(Client()), SignatureAuth(Client())
+    # both implementations must produce the very same signed query
+    fixed_time = time.time
+    time.time = lambda: 1400000000
+    legacy_query = url_parse.urlsplit(legacy.authenticate('https://mixpanel.com', params()).get_full_url()).query
+    current_query = url_parse.urlsplit(current.authenticate('https://mixpanel.com', params()).get_full_url()).query
+    assert sorted(url_parse.parse_qsl(legacy_query)) == sorted(url_parse.parse_qsl(current_query))
+    time.time = fixed_time
+
+    before = run(legacy, args.seconds)
+    after = run(current, args.seconds)
+    print('{0:<10} {1:>12}'.format('auth', 'requests/s'))
+    print('{0:<10} {1:>12.0f}'.format('before', before))
+    print('{0:<10} {1:>12.0f}'.format('after', after))
+    print('speedup    {0:>11.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compares the keep-alive `HTTPTransport` against the one-connection-per-request
+`UrllibTransport` by firing segmentation queries at a local fake Mixpanel API.
+
+The fake server (see `fake_server.py`) speaks plain http, so there is no
+real TLS handshake to save; the cost of establishing a connection (TCP + TLS
+round trips to mixpanel.com) is simulated with `--connect-latency`, which the
+server sleeps for every new connection it accepts.
+
+Usage:
+    python benchmarks/bench_connection.py [--requests 200] [--connect-latency 0.05]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_server import FakeMixpanelServer
+
+from mixpanel_query.auth import SecretAuth
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.transport import HTTPTransport, UrllibTransport
+
+
+def run(transport, server, num_requests):
+    client = server.configure(MixpanelQueryClient('key', 'secret', auth_class=SecretAuth, transport=transport))
+    server.reset_counters()
+
+    started = time.time()
+    for _ in range(num_requests):
+        client.get_segmentation('signed up', '2014-04-01', '2014-04-02')
+    elapsed = time.time() - started
+    transport.close()
+    return elapsed, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--connect-latency', type=float, default=0.05,
+                        help='seconds the server sleeps per new connection (simulated handshake)')
+    args = parser.parse_args()
+
+    server = FakeMixpanelServer(connect_latency=args.connect_latency, segments=1).start()
+
+    print('{0:<16} {1:>10} {2:>12} {3:>12}'.format('transport', 'seconds', 'requests/s', 'connections'))
+    for name, transport in (('urllib', UrllibTransport()), ('keep-alive', HTTPTransport())):
+        elapsed, connections = run(transport, server, args.requests)
+        print('{0:<16} {1:>10.3f} {2:>12.1f} {3:>12}'.format(name, elapsed, args.requests / elapsed, connections))
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Measures how many events per second `get_export` parses from a synthetic
+export, with the previous decoding (the whole body decoded to text, then
+`json.loads` on every line) and with each installed JSON decoder, parsing
+on the calling thread or, with `--processes`, on a pool of worker processes.
+
+The response is served from memory, so only splitting and decoding are
+measured.
+
+Usage:
+    python benchmarks/bench_json.py [--events 200000] [--repeat 3] [--processes 0]
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_server import synthetic_export
+
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.decoders import available_decoders
+from mixpanel_query.utils import _totext
+
+
+def legacy_get_export(body):
+    " The decoding of `get_export` as it was before decoding straight from bytes. "
+    for line in _totext(body).split('\n'):
+        if line:
+            yield json.loads(line)
+
+
+def make_client(body, json_decoder):
+    client = MixpanelQueryClient('key', 'secret', json_decoder=json_decoder)
+    client.connection.raw_request = lambda *args, **kwargs: io.BytesIO(body)
+    return client
+
+
+def best_rate(func, num_events, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        count = sum(1 for _ in func())
+        elapsed = time.time() - started
+        assert count == num_events
+        best = elapsed if best is None else min(best, elapsed)
+    return num_events / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--processes', type=int, default=0, help='also parse with this many worker processes')
+    args = parser.parse_args()
+
+    body = synthetic_export(args.events)
+    expected = list(legacy_get_export(body))
+
+    before = best_rate(lambda: legacy_get_export(body), args.events, args.repeat)
+    print('{0:<10} {1:>8} {2:>10} {3:>12} {4:>9}'.format('decoder', 'stream', 'processes', 'events/s', 'speedup'))
+    print('{0:<10} {1:>8} {2:>10} {3:>12.0f} {4:>8.2f}x'.format('before', '-', '-', before, 1))
+    for name in available_decoders():
+        for stream in (False, True):
+            for processes in [None] + ([args.processes] if args.processes else []):
+                client = make_client(body, name)
+                kwargs = {'stream': stream, 'parse_processes': processes}
+                # every decoder must produce the very same events
+                assert list(client.get_export('2014-04-01', '2014-04-01', **kwargs)) == expected
+                rate = best_rate(
+                    lambda: client.get_export('2014-04-01', '2014-04-01', **kwargs),
+                    args.events,
+                    args.repeat
+                )
+                print('{0:<10} {1:>8} {2:>10} {3:>12.0f} {4:>8.2f}x'.format(
+                    name, str(stream), processes or '-', rate, rate / before))
+
+
+if __name__ == '__main__':
+    main()
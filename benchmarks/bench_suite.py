@@ -0,0 +1,216 @@
+"""
+Runs repeatable client scenarios against the local fake Mixpanel API (see
+`fake_server.py`) and reports, per scenario:
+
+    requests/s   API requests completed per second
+    items/s      events, profiles or query results received per second
+    p50, p99     request latency in milliseconds (retries included)
+    peak RSS     the peak resident memory of the client process, in MB
+
+Scenarios:
+    queries          many small segmentation queries issued through `batch()`
+    funnels          the detail of every funnel of `get_funnel_list()`, through `batch()`
+    people           every engage profile, through `ConcurrentPaginator.iter_all()`
+    export           a large export read with `get_export(stream=True)`
+    export-buffered  the same export read with `get_export()` (whole body in memory)
+
+Each scenario runs in its own process so that peak RSS is not inflated by
+the server or by the other scenarios. Latencies are measured with a
+collector (see `mixpanel_query.instrumentation`).
+
+Usage:
+    python benchmarks/bench_suite.py [scenario ...] [--latency 0.02] [--queries 500]
+                                     [--profiles 50000] [--export-events 200000] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from fake_server import FakeMixpanelServer
+
+from mixpanel_query.auth import SecretAuth
+from mixpanel_query.batch import QuerySpec
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.paginator import ConcurrentPaginator
+
+SCENARIOS = ('queries', 'funnels', 'people', 'export', 'export-buffered')
+
+
+class LatencyCollector(object):
+    " Keeps the duration of every request. "
+
+    def __init__(self):
+        self.durations = []
+        self._lock = threading.Lock()
+
+    def on_request(self, metrics):
+        with self._lock:
+            self.durations.append(metrics.duration or 0.0)
+
+    def percentile(self, fraction):
+        durations = sorted(self.durations)
+        if not durations:
+            return None
+        return durations[min(len(durations) - 1, int(round(fraction * (len(durations) - 1))))]
+
+
+def peak_rss_mb():
+    # on Linux, `ru_maxrss` survives `exec` and would include the parent's (the server's)
+    # memory at fork time; the high water mark of the process' own address space doesn't
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def scenario_queries(client, args):
+    specs = [
+        QuerySpec('get_segmentation', 'event {0}'.format(i), '2014-04-01', '2014-04-07')
+        for i in range(args.queries)
+    ]
+    result = client.batch(specs, concurrency=args.concurrency)
+    assert result.ok, result.errors
+    return len(result.results)
+
+
+def scenario_funnels(client, args):
+    funnels = client.get_funnel_list()
+    specs = [QuerySpec('get_funnel_detail', funnel['funnel_id'], '2014-04-01', '2014-04-30') for funnel in funnels]
+    result = client.batch(specs, concurrency=args.concurrency)
+    assert result.ok, result.errors
+    return len(result.results)
+
+
+def scenario_people(client, args):
+    with ConcurrentPaginator(client.get_engage, concurrency=args.concurrency) as paginator:
+        return sum(1 for _ in paginator.iter_all())
+
+
+def scenario_export(client, args):
+    return sum(1 for _ in client.get_export('2014-04-01', '2014-04-01', stream=True))
+
+
+def scenario_export_buffered(client, args):
+    return sum(1 for _ in client.get_export('2014-04-01', '2014-04-01'))
+
+
+def run_scenario(name, url, args):
+    " Run one scenario against the server at `url` and return its measurements. "
+    collector = LatencyCollector()
+    client = MixpanelQueryClient('key', 'secret', auth_class=SecretAuth, collector=collector)
+    client.connection.ENDPOINT = client.connection.DATA_ENDPOINT = url
+
+    scenario = globals()['scenario_' + name.replace('-', '_')]
+    started = time.time()
+    items = scenario(client, args)
+    elapsed = time.time() - started
+    client.close()
+
+    p50, p99 = collector.percentile(0.5), collector.percentile(0.99)
+    return {
+        'scenario': name,
+        'seconds': elapsed,
+        'requests': len(collector.durations),
+        'requests_per_second': len(collector.durations) / elapsed,
+        'items': items,
+        'items_per_second': items / elapsed,
+        'p50_ms': p50 * 1000 if p50 is not None else None,
+        'p99_ms': p99 * 1000 if p99 is not None else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _format(value, spec):
+    return '-' if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help='one of {0} (default: all)'.format(', '.join(SCENARIOS)))
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the server waits before each response')
+    parser.add_argument('--connect-latency', type=float, default=0.0, help='seconds the server waits per new connection')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--segments', type=int, default=10)
+    parser.add_argument('--funnels', type=int, default=50)
+    parser.add_argument('--profiles', type=int, default=50000)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--export-events', type=int, default=200000)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error('unknown scenario {0!r}'.format(name))
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    if args.run_scenario:
+        # child process: run a single scenario against the parent's server
+        print(json.dumps(run_scenario(args.run_scenario, args.url, args)))
+        return
+
+    server = FakeMixpanelServer(
+        latency=args.latency,
+        connect_latency=args.connect_latency,
+        segments=args.segments,
+        funnels=args.funnels,
+        engage_total=args.profiles,
+        engage_page_size=args.page_size,
+        export_events=args.export_events,
+    ).start()
+    # generate the export up front, so the first export scenario doesn't pay for it
+    server.export_body('2014-04-01', '2014-04-01', True)
+    server.export_body('2014-04-01', '2014-04-01', False)
+
+    forwarded = [
+        '--concurrency', str(args.concurrency), '--queries', str(args.queries),
+    ]
+    results = []
+    try:
+        for name in args.scenarios:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), '--run-scenario', name, '--url', server.url] + forwarded
+            )
+            results.append(json.loads(output.decode('utf-8')))
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print('{0:<16} {1:>9} {2:>11} {3:>12} {4:>9} {5:>9} {6:>10}'.format(
+        'scenario', 'seconds', 'requests/s', 'items/s', 'p50 ms', 'p99 ms', 'peak RSS'))
+    for result in results:
+        print('{0:<16} {1:>9.3f} {2:>11} {3:>12} {4:>9} {5:>9} {6:>10}'.format(
+            result['scenario'],
+            result['seconds'],
+            _format(result['requests_per_second'], '.1f'),
+            _format(result['items_per_second'], '.0f'),
+            _format(result['p50_ms'], '.1f'),
+            _format(result['p99_ms'], '.1f'),
+            _format(result['peak_rss_mb'], '.1f') + ' MB' if result['peak_rss_mb'] is not None else '-',
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+A local stand-in for the Mixpanel API, serving deterministic synthetic data
+so that benchmarks are repeatable and never touch the real API:
+
+    /api/2.0/engage/         pages of `engage_page_size` profiles out of `engage_total`,
+                             with a `session_id`
+    /api/2.0/export/         `export_events` NDJSON events per day of the range, gzipped
+                             when the client accepts it
+    /api/2.0/segmentation/   `segments` segments with one value per day (or hour) of the range
+    /api/2.0/events/         the same shape, over the last `interval` units or a date range
+    /api/2.0/funnels/list/   `funnels` funnels
+    /api/2.0/funnels/        the detail of a funnel with `funnel_steps` steps per day
+
+Every response is delayed by `latency` seconds, and every new connection by
+`connect_latency` seconds (a stand-in for the TCP and TLS handshakes). A
+fraction `error_rate` of the requests is answered with a 429. Authentication
+is not checked.
+
+Example:
+    server = FakeMixpanelServer(latency=0.05).start()
+    client = MixpanelQueryClient('key', 'secret')
+    server.configure(client)
+    ...
+    server.stop()
+"""
+import datetime
+import gzip
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib import parse as url_parse
+
+
+def synthetic_export(num_events, seed=0, start_time=1396310400):
+    " Return `num_events` NDJSON export lines shaped like Mixpanel's. "
+    rand = random.Random(seed)
+    lines = []
+    for i in range(num_events):
+        lines.append(json.dumps({
+            'event': rand.choice(['Viewed report', 'signed up', 'logged in', u'compr\xe9']),
+            'properties': {
+                'distinct_id': '{0:016x}'.format(rand.getrandbits(64)),
+                'time': start_time + i,
+                '$browser': rand.choice(['Chrome', 'Firefox', 'Safari']),
+                '$os': rand.choice(['Linux', 'Mac OS X', 'Windows']),
+                '$referrer': 'https://mixpanel.com/report/3/stream/',
+                'mp_country_code': rand.choice(['US', 'FR', 'DE', 'JP']),
+                'Project ID': str(rand.randint(1, 100)),
+                'duration': rand.random() * 100,
+                'is_trial': rand.random() < 0.1,
+            },
+        }))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def synthetic_value(*key):
+    " A deterministic count for a `(event, segment, date)`-like key. "
+    return zlib.crc32(json.dumps(key).encode('utf-8')) % 1000
+
+
+def date_series(from_date, to_date, unit):
+    " The dates (or hours) of a range, formatted like Mixpanel's `series`. "
+    start = datetime.datetime.strptime(from_date[:10], '%Y-%m-%d')
+    end = datetime.datetime.strptime(to_date[:10], '%Y-%m-%d')
+    if unit == 'hour':
+        step, fmt, end = datetime.timedelta(hours=1), '%Y-%m-%d %H:00:00', end + datetime.timedelta(hours=23)
+    else:
+        step, fmt = datetime.timedelta(days=1), '%Y-%m-%d'
+    series = []
+    while start <= end:
+        series.append(start.strftime(fmt))
+        start += step
+    return series
+
+
+class FakeMixpanelServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, connect_latency=0.0, error_rate=0.0,
+                 segments=3, engage_total=10000, engage_page_size=1000, export_events=10000,
+                 funnels=10, funnel_steps=3, seed=0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeMixpanelHandler)
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.error_rate = error_rate
+        self.segments = segments
+        self.engage_total = engage_total
+        self.engage_page_size = engage_page_size
+        self.export_events = export_events
+        self.funnels = funnels
+        self.funnel_steps = funnel_steps
+        self.seed = seed
+
+        self.connections = 0
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._export_bodies = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/api'.format(*self.server_address[:2])
+
+    def configure(self, client):
+        " Point `client` (query and export endpoints) at this server. "
+        client.connection.ENDPOINT = client.connection.DATA_ENDPOINT = self.url
+        return client
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = self.requests = 0
+
+    def count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def throttled(self):
+        with self._lock:
+            return self.error_rate and self._random.random() < self.error_rate
+
+    def export_body(self, from_date, to_date, compress):
+        " The export of a date range, generated (and compressed) once. "
+        key = (from_date, to_date, compress)
+        with self._lock:
+            body = self._export_bodies.get(key)
+        if body is not None:
+            return body
+
+        days = []
+        for day in date_series(from_date, to_date, 'day'):
+            start_time = int((datetime.datetime.strptime(day, '%Y-%m-%d') - datetime.datetime(1970, 1, 1)).total_seconds())
+            days.append(synthetic_export(self.export_events, seed='{0}:{1}'.format(self.seed, day), start_time=start_time))
+        body = b''.join(days)
+        if compress:
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=1) as compressed:
+                compressed.write(body)
+            body = buf.getvalue()
+        with self._lock:
+            self._export_bodies[key] = body
+        return body
+
+
+class FakeMixpanelHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count('connections')
+        if self.server.connect_latency:
+            time.sleep(self.server.connect_latency)
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+        parsed = url_parse.urlsplit(self.path)
+        method = parsed.path.strip('/').split('/', 2)[-1]
+        params = dict((key, values[-1]) for key, values in url_parse.parse_qs(parsed.query).items())
+
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttled():
+            return self._respond(429, b'{"error": "rate limited"}', headers={'Retry-After': '0'})
+
+        handler = getattr(self, 'api_' + method.replace('/', '_'), None)
+        if handler is None:
+            return self._respond(404, b'{"error": "unknown method"}')
+        handler(params)
+
+    def _respond(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, data):
+        self._respond(200, json.dumps(data).encode('utf-8'))
+
+    def _values(self, event, series):
+        return dict(
+            ('{0} segment {1}'.format(event, segment), dict(
+                (date, synthetic_value(event, segment, date)) for date in series
+            ))
+            for segment in range(self.server.segments)
+        )
+
+    def api_segmentation(self, params):
+        event = params.get('event', '')
+        series = date_series(params['from_date'], params['to_date'], params.get('unit', 'day'))
+        self._json({'data': {'series': series, 'values': self._values(event, series)}, 'legend_size': self.server.segments})
+
+    def api_events(self, params):
+        unit = params.get('unit', 'day')
+        if 'from_date' in params:
+            series = date_series(params['from_date'], params['to_date'], unit)
+        else:
+            interval = int(params.get('interval', 1))
+            delta = datetime.timedelta(hours=1) if unit == 'hour' else datetime.timedelta(days=1)
+            today = datetime.datetime(2014, 4, 30)
+            fmt = '%Y-%m-%d %H:00:00' if unit == 'hour' else '%Y-%m-%d'
+            series = [(today - delta * i).strftime(fmt) for i in reversed(range(interval))]
+        events = json.loads(params.get('event', '[]'))
+        values = {}
+        for event in events:
+            values.update(self._values(event, series))
+        self._json({'data': {'series': series, 'values': values}, 'legend_size': len(values)})
+
+    def api_funnels_list(self, params):
+        self._json([
+            {'funnel_id': funnel_id, 'name': 'Funnel {0}'.format(funnel_id)}
+            for funnel_id in range(1, self.server.funnels + 1)
+        ])
+
+    def api_funnels(self, params):
+        funnel_id = params.get('funnel_id')
+        dates = date_series(params['from_date'], params['to_date'], 'day')
+        data = {}
+        for date in dates:
+            count = 1000 + synthetic_value(funnel_id, date)
+            steps = []
+            for step in range(self.server.funnel_steps):
+                steps.append({'count': count, 'goal': 'step {0}'.format(step), 'overall_conv_ratio': 1.0, 'step_conv_ratio': 1.0})
+                count //= 2
+            data[date] = {'analysis': {'completion': 0.5, 'starting_amount': steps[0]['count'], 'steps': len(steps), 'worst': 1}, 'steps': steps}
+        self._json({'meta': {'dates': dates}, 'data': data})
+
+    def api_engage(self, params):
+        server = self.server
+        page = int(params.get('page', 0))
+        first = page * server.engage_page_size
+        results = [
+            {'$distinct_id': index, '$properties': {
+                '$email': 'user{0}@example.com'.format(index),
+                '$created': '2014-04-01T00:00:00',
+                'plan': 'pro' if synthetic_value('plan', index) < 100 else 'free',
+            }}
+            for index in range(first, min(first + server.engage_page_size, server.engage_total))
+        ]
+        self._json({
+            'page': page,
+            'page_size': server.engage_page_size,
+            'results': results,
+            'session_id': params.get('session_id') or '1234567890-FAKE',
+            'status': 'ok',
+            'total': server.engage_total,
+        })
+
+    def api_export(self, params):
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = self.server.export_body(params['from_date'], params['to_date'], compress)
+        self._respond(200, body, content_type='text/plain')
+
+    def log_message(self, *args):
+        pass
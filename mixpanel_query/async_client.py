@@ -0,0 +1,536 @@
+"""
+An asyncio flavour of `MixpanelQueryClient`. Every query method returns a
+coroutine, and requests are sent over non-blocking keep-alive connections so
+that thousands of queries can be in flight on a single event loop.
+
+Requires Python 3.6+.
+"""
+import asyncio
+import collections
+import io
+import ssl
+import time
+
+from six.moves import http_client
+from six.moves.urllib import error as url_error
+from six.moves.urllib import parse as url_parse
+
+from mixpanel_query import exceptions
+from mixpanel_query.auth import SignatureAuth
+from mixpanel_query.batch import BatchResult
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.connection import Connection
+from mixpanel_query.retry import RetryPolicy
+from mixpanel_query.utils import DEFAULT_CHUNK_SIZE, _LineSplitter, _merge_series
+
+__all__ = ('AsyncMixpanelQueryClient', 'AsyncConnection', 'AsyncHTTPTransport')
+
+
+class AsyncResponse(object):
+    """
+    A response read from an asyncio stream. The body must be read to the end
+    (or the response closed) for the connection to be returned to its pool.
+    """
+
+    def __init__(self, url, status, reason, headers, reader, release, timeout):
+        self.url = url
+        self.status = self.code = status
+        self.reason = self.msg = reason
+        self.headers = headers
+        self._reader = reader
+        self._release = release
+        self._timeout = timeout
+        self._chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self._length = None
+        self._chunk_left = 0
+        self.will_close = (
+            headers.get('Connection', '').lower() == 'close'
+        )
+
+        if status in (204, 304) or 100 <= status < 200:
+            self._length = 0
+        elif not self._chunked:
+            content_length = headers.get('Content-Length')
+            if content_length is not None:
+                self._length = int(content_length)
+            else:
+                # the body is delimited by the server closing the connection
+                self.will_close = True
+        if self._length == 0:
+            self._finish(reusable=True)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    async def read(self, amt=None):
+        """
+        Read up to `amt` bytes of the body, or the whole (remaining) body when
+        `amt` is None.
+        """
+        if amt is not None:
+            return await self._read_some(amt)
+        chunks = []
+        while True:
+            chunk = await self._read_some(DEFAULT_CHUNK_SIZE)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    async def _read_some(self, amt):
+        if self._release is None:
+            return b''
+        try:
+            if self._chunked:
+                return await self._read_chunk(amt)
+            if self._length is None:
+                data = await self._wait(self._reader.read(amt))
+                if not data:
+                    self._finish(reusable=False)
+                return data
+
+            data = await self._wait(self._reader.read(min(amt, self._length)))
+            if not data:
+                raise http_client.IncompleteRead(b'', self._length)
+            self._length -= len(data)
+            if self._length == 0:
+                self._finish(reusable=True)
+            return data
+        except BaseException:
+            self._finish(reusable=False)
+            raise
+
+    async def _read_chunk(self, amt):
+        if self._chunk_left == 0:
+            size_line = await self._wait(self._reader.readline())
+            self._chunk_left = int(size_line.split(b';', 1)[0].strip(), 16)
+            if self._chunk_left == 0:
+                # skip the trailers up to the final blank line
+                while (await self._wait(self._reader.readline())).strip():
+                    pass
+                self._finish(reusable=True)
+                return b''
+
+        data = await self._wait(self._reader.read(min(amt, self._chunk_left)))
+        if not data:
+            raise http_client.IncompleteRead(b'', self._chunk_left)
+        self._chunk_left -= len(data)
+        if self._chunk_left == 0:
+            await self._wait(self._reader.readexactly(2))
+        return data
+
+    def _wait(self, awaitable):
+        return asyncio.wait_for(awaitable, self._timeout)
+
+    def close(self):
+        self._finish(reusable=False)
+
+    def _finish(self, reusable):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(reusable and not self.will_close)
+
+
+class AsyncConnectionPool(object):
+    """
+    Keeps up to `maxsize` idle keep-alive connections to a single host and
+    allows at most `max_connections` requests to it at the same time; any
+    further requests wait for a connection to be released.
+    """
+
+    def __init__(self, scheme, host, port, maxsize, max_connections):
+        self.scheme = scheme
+        self.host = host
+        self.port = port or (443 if scheme == 'https' else 80)
+        self.maxsize = maxsize
+        self.max_connections = max_connections
+        self._idle = []
+        self._closed = False
+        self._semaphore = None
+
+    async def _new_conn(self, timeout):
+        ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+        return await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context),
+            timeout
+        )
+
+    async def urlopen(self, url, method, selector, headers, timeout, idempotent=True):
+        """
+        Issue a request and return an `AsyncResponse`. A connection that went
+        stale while idle is retried once on a fresh connection; requests which
+        are not `idempotent` always open a fresh connection and are never sent twice.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        await self._semaphore.acquire()
+        try:
+            reused = idempotent and bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await self._new_conn(timeout)
+            while True:
+                try:
+                    return await self._send(url, method, selector, headers, timeout, reader, writer)
+                except asyncio.TimeoutError:
+                    writer.close()
+                    raise
+                except (http_client.HTTPException, asyncio.IncompleteReadError, OSError):
+                    writer.close()
+                    if not reused:
+                        raise
+                    reader, writer = await self._new_conn(timeout)
+                    reused = False
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def _send(self, url, method, selector, headers, timeout, reader, writer):
+        request_lines = ['{0} {1} HTTP/1.1'.format(method, selector)]
+        request_lines.extend('{0}: {1}'.format(name, value) for name, value in headers.items())
+        writer.write(('\r\n'.join(request_lines) + '\r\n\r\n').encode('latin-1'))
+        await asyncio.wait_for(writer.drain(), timeout)
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        if not status_line:
+            raise http_client.RemoteDisconnected('Remote end closed connection without response')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        header_lines = []
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line)
+        response_headers = http_client.parse_headers(io.BytesIO(b''.join(header_lines) + b'\r\n'))
+
+        def release(reusable):
+            if reusable and not self._closed:
+                if len(self._idle) < self.maxsize:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+            else:
+                writer.close()
+            self._semaphore.release()
+
+        response = AsyncResponse(url, int(status), reason, response_headers, reader, release, timeout)
+        if version == 'HTTP/1.0' and response_headers.get('Connection', '').lower() != 'keep-alive':
+            response.will_close = True
+        return response
+
+    def close(self):
+        self._closed = True
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+class AsyncHTTPTransport(object):
+    """
+    The non-blocking counterpart of `HTTPTransport`.
+
+    `pool_size` is the number of idle connections kept per host (`pool_sizes`
+    overrides it per host or base url), and `max_connections` caps the number
+    of requests sent to one host at the same time.
+    """
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_MAX_CONNECTIONS = 100
+    MAX_REDIRECTS = 5
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_sizes=None, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.pool_size = pool_size
+        self.pool_sizes = dict(
+            (url_parse.urlsplit(key).netloc or key, size)
+            for key, size in (pool_sizes or {}).items()
+        )
+        self.max_connections = max_connections
+        self._pools = {}
+
+    def _get_pool(self, scheme, netloc):
+        key = (scheme, netloc)
+        pool = self._pools.get(key)
+        if pool is None:
+            parsed = url_parse.urlsplit('//' + netloc)
+            pool = AsyncConnectionPool(
+                scheme,
+                parsed.hostname,
+                parsed.port,
+                self.pool_sizes.get(netloc, self.pool_size),
+                self.max_connections,
+            )
+            self._pools[key] = pool
+        return pool
+
+    async def open(self, request_obj, timeout, idempotent=True):
+        """
+        Issue the request and return an `AsyncResponse`. Like `urlopen`,
+        redirects are followed and error statuses raise an `HTTPError`.
+        Requests which are not `idempotent` are sent at most once.
+        """
+        url = request_obj.get_full_url()
+        method = request_obj.get_method()
+        headers = dict(request_obj.header_items())
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parsed = url_parse.urlsplit(url)
+            selector = parsed.path or '/'
+            if parsed.query:
+                selector = '{0}?{1}'.format(selector, parsed.query)
+            headers['Host'] = parsed.netloc
+
+            pool = self._get_pool(parsed.scheme, parsed.netloc)
+            response = await pool.urlopen(url, method, selector, headers, timeout, idempotent)
+
+            location = response.headers.get('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                await response.read()
+                url = url_parse.urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                body = await response.read()
+                raise url_error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+            return response
+
+        raise url_error.HTTPError(url, response.status, 'Too many redirects', response.headers, None)
+
+    def close(self):
+        """
+        Close every idle connection held by the transport.
+        """
+        pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+class AsyncConnection(Connection):
+    """
+    A `Connection` whose `request` and `raw_request` methods are coroutines.
+    """
+
+    def __init__(self, client, transport=None, retry_policy=None, json_decoder=None):
+        super(AsyncConnection, self).__init__(
+            client,
+            transport=transport if transport is not None else AsyncHTTPTransport(),
+            retry_policy=retry_policy,
+            json_decoder=json_decoder
+        )
+
+    async def request(self, method_name, params, response_format='json'):
+        """
+        Make a request to Mixpanel query endpoints and return the
+        parsed response.
+        """
+        response = await self.raw_request(self.ENDPOINT, method_name, params, response_format)
+        data = await response.read()
+        return self.json_loads(data)
+
+    async def raw_request(self, base_url, method_name, params, response_format, headers=None):
+        """
+        Make a request to the Mixpanel API and return an `AsyncResponse`,
+        retrying according to the connection's `retry_policy`. The blocking
+        `rate_limiter` is not supported here. Write methods are sent at most once.
+        """
+        attempt = 0
+        while True:
+            request_obj = self.build_request(base_url, method_name, params.copy(), response_format, headers)
+            try:
+                return await self.transport.open(
+                    request_obj, self.effective_timeout(), idempotent=method_name not in self.WRITE_METHODS)
+            except Exception as e:
+                if (method_name in self.WRITE_METHODS or attempt >= self.retry_policy.max_retries or
+                        not self.retry_policy.is_retryable(e)):
+                    raise
+                delay = self.retry_policy.backoff(attempt, e)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+async def _aiter_response_lines(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Asynchronously read an `AsyncResponse` and yield each non-empty line,
+    transparently decompressing gzip bodies.
+    """
+    splitter = _LineSplitter()
+    try:
+        while True:
+            chunk = await response.read(chunk_size)
+            if not chunk:
+                break
+            for line in splitter.feed(chunk):
+                yield line
+        for line in splitter.finish():
+            yield line
+    finally:
+        response.close()
+
+
+class AsyncMixpanelQueryClient(MixpanelQueryClient):
+    """
+    Exposes the same methods as `MixpanelQueryClient`, but each of them returns
+    a coroutine (and `get_export` an async generator). Arguments are validated
+    when the method is called, before anything is awaited.
+
+    Example:
+        async with AsyncMixpanelQueryClient(API_KEY, API_SECRET) as client:
+            results = await asyncio.gather(*[
+                client.get_segmentation(event, '2014-04-01', '2014-04-30')
+                for event in events
+            ])
+    """
+
+    def __init__(
+            self, api_key, api_secret, timeout=None, auth_class=SignatureAuth, transport=None, retry_policy=None,
+            json_decoder=None):
+        super(AsyncMixpanelQueryClient, self).__init__(api_key, api_secret, timeout=timeout, auth_class=auth_class)
+        self.connection = AsyncConnection(self, transport=transport, retry_policy=retry_policy, json_decoder=json_decoder)
+
+    async def get_export(self, start_date, end_date, event=None, where=None, bucket_id=None,
+                         response_format=MixpanelQueryClient.FORMAT_JSON, stream=False):
+        """
+        Get a "raw dump" of tracked events over a time period.
+
+        See `MixpanelQueryClient.get_export()`; use with `async for`.
+        """
+        response = await self.connection.raw_request(
+            self.connection.DATA_ENDPOINT,
+            'export',
+            self._export_params(start_date, end_date, event, where, bucket_id),
+            response_format,
+            headers={'Accept-Encoding': 'gzip'} if stream else None
+        )
+        json_loads = self.connection.json_loads
+        if stream:
+            async for line in _aiter_response_lines(response):
+                yield json_loads(line)
+            return
+
+        response_data = await response.read()
+        for line in response_data.split(b'\n'):
+            if line:
+                yield json_loads(line)
+
+    async def batch(self, specs, concurrency=8):
+        """
+        Run many queries concurrently on the event loop, up to `concurrency` at once.
+
+        See `MixpanelQueryClient.batch()`; each spec must name a coroutine method.
+        """
+        unique_specs = list(collections.OrderedDict((spec, None) for spec in specs))
+        results, errors, latencies = {}, {}, {}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _run(spec):
+            async with semaphore:
+                started = time.time()
+                try:
+                    return spec, True, await spec.run(self), time.time() - started
+                except Exception as e:
+                    return spec, False, e, time.time() - started
+
+        started = time.time()
+        for spec, succeeded, value, latency in await asyncio.gather(*[_run(spec) for spec in unique_specs]):
+            (results if succeeded else errors)[spec] = value
+            latencies[spec] = latency
+        return BatchResult(results, errors, latencies, time.time() - started)
+
+    def export_to_file(self, *args, **kwargs):
+        """
+        Not supported by the asyncio client; use `MixpanelQueryClient.export_to_file()`.
+        """
+        raise NotImplementedError('`export_to_file` is not supported by `AsyncMixpanelQueryClient`; use `MixpanelQueryClient`.')
+
+    def get_export_incremental(self, *args, **kwargs):
+        """
+        Not supported by the asyncio client; use `MixpanelQueryClient.get_export_incremental()`.
+        """
+        raise NotImplementedError(
+            '`get_export_incremental` is not supported by `AsyncMixpanelQueryClient`; use `MixpanelQueryClient`.')
+
+    def fetch_all_funnels(
+            self, start_date, end_date,
+            length=14, interval=1, unit=MixpanelQueryClient.UNIT_DAY, on=None, where=None,
+            concurrency=8, retries=2):
+        """
+        Get the data of every funnel, fetched concurrently on the event loop.
+
+        See `MixpanelQueryClient.fetch_all_funnels()`; use with `async for`.
+        """
+        if self._validate_date(start_date) > self._validate_date(end_date):
+            raise exceptions.InvalidDateException('The `start_date` specified after the `end_date`; you will not receive any funnels.')
+        detail_kwargs = dict(length=length, interval=interval, unit=unit, on=on, where=where)
+        return self._aiter_funnel_details(start_date, end_date, detail_kwargs, concurrency, retries)
+
+    async def _aiter_funnel_details(self, start_date, end_date, detail_kwargs, concurrency, retries):
+        funnel_ids = [funnel['funnel_id'] for funnel in await self.get_funnel_list()]
+        retry_policy = RetryPolicy(max_retries=retries, backoff_factor=1)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _fetch_funnel(funnel_id):
+            async with semaphore:
+                attempt = 0
+                while True:
+                    try:
+                        return funnel_id, await self.get_funnel_detail(funnel_id, start_date, end_date, **detail_kwargs)
+                    except Exception as e:
+                        if attempt >= retry_policy.max_retries or not retry_policy.is_retryable(e):
+                            raise
+                        delay = retry_policy.backoff(attempt, e)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+        tasks = [asyncio.ensure_future(_fetch_funnel(funnel_id)) for funnel_id in funnel_ids]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # stopping early (or a failure) doesn't fetch the remaining funnels
+            for task in tasks:
+                task.cancel()
+
+    def _fetch_windows(self, method_name, params, unit, response_format, window_days, concurrency):
+        """
+        Utility method returning a coroutine which requests the windows of `params`
+        concurrently on the event loop and merges their series; see `get_segmentation()`.
+        """
+        windows = self._request_windows(params, unit, response_format, window_days)
+        if len(windows) <= 1:
+            return self.connection.request(method_name, params, response_format=response_format)
+        return self._gather_windows(method_name, params, response_format, windows, concurrency)
+
+    async def _gather_windows(self, method_name, params, response_format, windows, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _fetch_window(window):
+            async with semaphore:
+                window_params = dict(params, from_date=window[0], to_date=window[1])
+                return await self.connection.request(method_name, window_params, response_format=response_format)
+
+        return _merge_series(await asyncio.gather(*[_fetch_window(window) for window in windows]))
+
+    async def close(self):
+        """
+        Close the idle connections held by the client's transport.
+        """
+        self.connection.transport.close()
+
+    @property
+    def executor(self):
+        """
+        Not available on the asyncio client, whose concurrent features run on the event loop.
+        """
+        raise TypeError('`AsyncMixpanelQueryClient` has no thread pool; its concurrent features run on the event loop.')
+
+    def __enter__(self):
+        raise TypeError('`AsyncMixpanelQueryClient` must be used with `async with`, not `with`.')
+
+    def __exit__(self, *exc_info):
+        raise TypeError('`AsyncMixpanelQueryClient` must be used with `async with`, not `with`.')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -4,11 +4,10 @@ the Mixpanel API
 """
 import base64
 import hashlib
-import json
 import time
 
 import six
-from mixpanel_query.utils import _tobytes, _totext, _unicode_urlencode
+from mixpanel_query.utils import _param_text, _serialize_params, _tobytes, _totext, _unicode_urlencode, _urlencode_pairs
 
 from six.moves.urllib import request as url_request
 
@@ -25,46 +24,46 @@ class SignatureAuth(object):
     for more details.
     """
     DEFAULT_EXPIRATION = 600  # expire requests after 10 minutes
+    # params set by the authentication itself
+    AUTH_PARAMS = ('api_key', 'expire', 'sig')
 
     def __init__(self, client):
         self.client = client
+        # encoded once and appended to every signed payload
+        self._secret = _tobytes(client.api_secret) if client.api_secret else b''
 
     def _hash_args(self, args, secret=None):
         """
         Hashes arguments by joining key=value pairs, appending the api_secret, and
         then taking the MD5 hex digest.
-        """
-        for arg in args:
-            if isinstance(args[arg], list):
-                args[arg] = json.dumps(args[arg])
-
-        arg_strings = ["{}={}".format(arg, args[arg]) for arg in sorted(args.keys())]
-        args_joined_string = ''.join(arg_strings)
-        args_joined = _tobytes(args_joined_string)
-
-        hash = hashlib.md5(args_joined)
 
-        if secret:
-            hash.update(_tobytes(secret))
-        elif self.client.api_secret:
-            hash.update(_tobytes(self.client.api_secret))
+        `args` may be a dict or a list of already serialized `(key, value)`
+        pairs sorted by key.
+        """
+        pairs = _serialize_params(args) if isinstance(args, dict) else args
+        hash = hashlib.md5(_tobytes(u''.join([key + u'=' + value for key, value in pairs])))
+        hash.update(_tobytes(secret) if secret else self._secret)
         return hash.hexdigest()
 
     def authenticate(self, url, params):
         """
         returns a request object ready to be issued to the Mixpanel API
+
+        Each param is serialized once, and the same serialized pairs are used
+        to compute the signature and the query string; `params` itself is left
+        untouched.
         """
-        params['api_key'] = self.client.api_key
-        params['expire'] = int(time.time()) + self.DEFAULT_EXPIRATION
+        pairs = [pair for pair in _serialize_params(params) if pair[0] not in self.AUTH_PARAMS]
+        pairs.append((u'api_key', _param_text(self.client.api_key)))
+        pairs.append((u'expire', six.text_type(int(time.time()) + self.DEFAULT_EXPIRATION)))
+        pairs.sort()
 
         # Creating signature
-        if 'sig' in params:
-            del params['sig']
-        params['sig'] = self._hash_args(params, self.client.api_secret)
+        pairs.append((u'sig', self._hash_args(pairs)))
 
         request_url = '{base_url}?{encoded_params}'.format(
             base_url=url,
-            encoded_params=_unicode_urlencode(params)
+            encoded_params=_urlencode_pairs(pairs)
         )
         return url_request.Request(request_url)
 
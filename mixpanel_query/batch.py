@@ -0,0 +1,104 @@
+"""
+The classes in this module run many queries against a `MixpanelQueryClient`
+concurrently; see `MixpanelQueryClient.batch()`.
+"""
+import collections
+import json
+import time
+
+import six
+
+__all__ = ('QuerySpec', 'BatchResult')
+
+
+class QuerySpec(object):
+    """
+    Describes one call of a client method, eg.
+
+        QuerySpec('get_segmentation', 'signed up', '2014-04-01', '2014-04-30', on='properties["$os"]')
+
+    Specs are hashable (even when their arguments are lists), so they can be
+    used to look up results in a `BatchResult`.
+    """
+
+    def __init__(self, method_name, *args, **kwargs):
+        self.method_name = method_name
+        self.args = args
+        self.kwargs = kwargs
+        self._key = json.dumps([method_name, args, kwargs], sort_keys=True, default=repr)
+
+    def __eq__(self, other):
+        return isinstance(other, QuerySpec) and self._key == other._key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        arguments = [repr(arg) for arg in self.args]
+        arguments.extend('{0}={1!r}'.format(key, value) for key, value in sorted(six.iteritems(self.kwargs)))
+        return 'QuerySpec({0!r}{1})'.format(self.method_name, ''.join(', ' + argument for argument in arguments))
+
+    def run(self, client):
+        return getattr(client, self.method_name)(*self.args, **self.kwargs)
+
+
+class BatchResult(object):
+    """
+    The outcome of a batch of queries:
+        `results`: {spec: response} for the queries which succeeded.
+        `errors`: {spec: exception} for the queries which failed.
+        `latencies`: {spec: seconds} spent on each query.
+        `wall_time`: seconds spent on the whole batch.
+    """
+
+    def __init__(self, results, errors, latencies, wall_time):
+        self.results = results
+        self.errors = errors
+        self.latencies = latencies
+        self.wall_time = wall_time
+
+    def __getitem__(self, spec):
+        " Return the response for `spec`, or raise the error it failed with. "
+        if spec in self.errors:
+            raise self.errors[spec]
+        return self.results[spec]
+
+    def __len__(self):
+        return len(self.latencies)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def total_latency(self):
+        " The summed latency of every query, ie. what running them serially would roughly cost. "
+        return sum(six.itervalues(self.latencies))
+
+
+def run_batch(client, specs, concurrency):
+    """
+    Run every spec against `client` on its shared executor, with up to
+    `concurrency` specs in flight, and return a `BatchResult`. Duplicate specs
+    are only run once.
+    """
+    unique_specs = list(collections.OrderedDict((spec, None) for spec in specs))
+    results, errors, latencies = {}, {}, {}
+
+    def _run(spec):
+        started = time.time()
+        try:
+            return spec, True, spec.run(client), time.time() - started
+        except Exception as e:
+            return spec, False, e, time.time() - started
+
+    started = time.time()
+    if unique_specs:
+        outcomes = client._map(_run, unique_specs, concurrency)
+        for spec, succeeded, value, latency in outcomes:
+            (results if succeeded else errors)[spec] = value
+            latencies[spec] = latency
+    return BatchResult(results, errors, latencies, time.time() - started)
@@ -0,0 +1,204 @@
+"""
+The classes in this module cache the raw bodies of Mixpanel API responses so
+repeated queries don't have to go back over the network.
+
+A cache is any object providing:
+    `get(key)`: return the cached body (bytes) or None.
+    `set(key, method_name, value, ttl)`: store a body; a `ttl` of None means
+                                         the entry never expires.
+    `invalidate(method_name)`: drop every entry stored for `method_name`.
+    `default_ttl`: the ttl (in seconds) used for responses which may still change.
+"""
+import collections
+import sqlite3
+import sys
+import threading
+import time
+
+import six
+
+__all__ = ('MemoryCache', 'SQLiteCache', 'SingleFlight')
+
+
+class MemoryCache(object):
+    """
+    Keeps responses in process memory for a short time, evicting the least
+    recently used entries once there are more than `max_entries` of them or
+    their bodies take more than `max_bytes`. `default_ttl` also caps the
+    lifetime of entries that could otherwise be cached indefinitely.
+
+    Example:
+        client = MixpanelQueryClient(API_KEY, API_SECRET, cache=MemoryCache(default_ttl=30))
+    """
+    DEFAULT_MAX_ENTRIES = 1024
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    DEFAULT_TTL = 60
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, method_name, expires_at = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            # mark the entry as the most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, method_name, value, ttl):
+        ttl = self.default_ttl if ttl is None else min(ttl, self.default_ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, method_name, time.time() + ttl)
+            self._size += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, method_name):
+        with self._lock:
+            for key in [key for key, entry in six.iteritems(self._entries) if entry[1] == method_name]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        value = self._entries.pop(key)[0]
+        self._size -= len(value)
+
+
+class SQLiteCache(object):
+    """
+    Stores responses in a local SQLite file, evicting the least recently used
+    entries once the total size of the stored bodies exceeds `max_bytes`.
+
+    Example:
+        cache = SQLiteCache('/var/cache/mixpanel.sqlite', max_bytes=512 * 1024 * 1024)
+        client = MixpanelQueryClient(API_KEY, API_SECRET, cache=cache)
+    """
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, default_ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, method_name TEXT, value BLOB, size INTEGER, '
+                'expires_at REAL, accessed_at REAL)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_method_name ON responses (method_name)')
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT value, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            self._db.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            return bytes(value)
+
+    def set(self, key, method_name, value, ttl):
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (key, method_name, sqlite3.Binary(value), len(value), expires_at, now)
+            )
+            self._evict(now)
+
+    def invalidate(self, method_name):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses WHERE method_name = ?', (method_name,))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, now):
+        " Drop expired entries, then the least recently used ones until under `max_bytes`. "
+        self._db.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+
+class _Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls: while a call for `key` is running,
+    other callers asking for the same key wait for it and share its result
+    (or exception) instead of making their own call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
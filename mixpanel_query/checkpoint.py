@@ -0,0 +1,58 @@
+"""
+The classes in this module remember which shards of an export have already
+been fetched; see `MixpanelQueryClient.get_export_incremental()`.
+
+A checkpoint store is any object providing:
+    `completed(filter_key)`: return the set of days (yyyy-mm-dd) completed for `filter_key`.
+    `mark_complete(day, filter_key)`: record `day` as completed for `filter_key`.
+"""
+import sqlite3
+import threading
+import time
+
+__all__ = ('SQLiteCheckpointStore',)
+
+
+class SQLiteCheckpointStore(object):
+    """
+    Records completed `(day, filter_key)` export shards in a local SQLite file.
+
+    Example:
+        checkpoints = SQLiteCheckpointStore('/var/lib/etl/mixpanel-checkpoints.sqlite')
+        for event in client.get_export_incremental('2014-01-01', '2014-04-30', checkpoints):
+            ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS export_shards ('
+                'day TEXT, filter_key TEXT, completed_at REAL, PRIMARY KEY (day, filter_key))'
+            )
+
+    def completed(self, filter_key):
+        with self._lock:
+            rows = self._db.execute('SELECT day FROM export_shards WHERE filter_key = ?', (filter_key,))
+            return set(row[0] for row in rows)
+
+    def mark_complete(self, day, filter_key):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO export_shards VALUES (?, ?, ?)',
+                (day, filter_key, time.time())
+            )
+
+    def reset(self, filter_key=None):
+        " Forget the completed shards of `filter_key`, or of every filter. "
+        with self._lock, self._db:
+            if filter_key is None:
+                self._db.execute('DELETE FROM export_shards')
+            else:
+                self._db.execute('DELETE FROM export_shards WHERE filter_key = ?', (filter_key,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
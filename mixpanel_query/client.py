@@ -1,10 +1,23 @@
 import datetime
+import functools
+import hashlib
 import json
+import multiprocessing
+import threading
+import warnings
+from multiprocessing.pool import ThreadPool
 import six
 
-from mixpanel_query import exceptions
+from mixpanel_query import exceptions, export
+from mixpanel_query.batch import run_batch
 from mixpanel_query.connection import Connection
-from mixpanel_query.utils import _totext
+from mixpanel_query.decoders import _is_native_decoder
+from mixpanel_query.retry import RetryPolicy
+from mixpanel_query.transport import HTTPTransport
+from mixpanel_query.utils import (
+    _bounded_imap, _chunked, _decode_events, _filter_lines, _iter_response_lines, _merge_series,
+    _parse_lines, _split_series_by_day, _totext
+)
 from mixpanel_query.auth import SignatureAuth
 
 
@@ -25,6 +38,8 @@ class MixpanelQueryClient(object):
     UNIT_WEEK = 'week'
     UNIT_MONTH = 'month'
     VALID_UNITS = (UNIT_MINUTE, UNIT_HOUR, UNIT_DAY, UNIT_WEEK, UNIT_MONTH)
+    # units whose buckets never straddle two date windows
+    WINDOWABLE_UNITS = (UNIT_MINUTE, UNIT_HOUR, UNIT_DAY)
 
     FORMAT_JSON = 'json'
     FORMAT_CSV = 'csv'
@@ -35,13 +50,85 @@ class MixpanelQueryClient(object):
     DATA_TYPE_UNIQUE = 'unique'
     VALID_DATA_TYPES = (DATA_TYPE_GENERAL, DATA_TYPE_AVERAGE, DATA_TYPE_UNIQUE)
 
-    def __init__(self, api_key, api_secret, timeout=None, auth_class=SignatureAuth):
+    # the number of export lines sent to a parse worker at a time
+    EXPORT_PARSE_CHUNK_LINES = 10000
+    # the number of threads of the shared executor, and of idle connections kept per host
+    DEFAULT_MAX_WORKERS = 10
+
+    def __init__(
+            self, api_key, api_secret, timeout=None, auth_class=SignatureAuth,
+            transport=None, cache=None, retry_policy=None, rate_limiter=None, json_decoder=None, collector=None,
+            series_store=None, executor=None, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Concurrent features (`batch()`, `fetch_all_funnels()`, export shards, date windows and
+        `ConcurrentPaginator`s of this client's methods) share one thread pool of `max_workers`
+        threads, created on first use; their own `concurrency` arguments only cap how many of
+        their tasks are in flight at once. A caller-owned `multiprocessing.pool.ThreadPool`
+        may be passed in via `executor` instead. Work started from one of the pool's threads
+        (eg. windows of a query run by `batch()`) runs on that thread, so nested features
+        never wait on a saturated pool.
+
+        `close()` (or leaving a `with` block) shuts down the executor and the idle connections
+        of the transport, unless they were passed in; the client may still be used afterwards.
+
+        Example:
+            with MixpanelQueryClient(API_KEY, API_SECRET, max_workers=8) as client:
+                result = client.batch(specs)
+        """
         self.api_key = _totext(api_key)
         self.api_secret = _totext(api_secret)
         self.timeout = timeout
-        self.connection = Connection(self)
+        # per-day results of `get_segmentation` and `get_events`, see `mixpanel_query.series_store`
+        self.series_store = series_store
+        self.max_workers = max_workers
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._executor_lock = threading.Lock()
+        self._worker = threading.local()
+        self._owns_transport = transport is None
+        self.connection = Connection(
+            self,
+            transport=transport if transport is not None else HTTPTransport(pool_size=max_workers),
+            cache=cache,
+            retry_policy=retry_policy,
+            rate_limiter=rate_limiter,
+            json_decoder=json_decoder,
+            collector=collector,
+        )
         self.auth = auth_class(self)
 
+    @property
+    def executor(self):
+        """
+        The thread pool shared by the client's concurrent features, created on first use
+        (eg. `ConcurrentPaginator(client.get_engage, pool=client.executor)`).
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPool(processes=self.max_workers)
+            return self._executor
+
+    def close(self):
+        """
+        Shut down the executor and close the idle connections of the transport, when they
+        are owned by the client. Tasks in flight are completed first; generators still running
+        on the executor (eg. `fetch_all_funnels()` or `ConcurrentPaginator.iter_all()`) raise
+        a `PoolClosedException` when they next need it.
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._owns_executor:
+            executor.close()
+            executor.join()
+        if self._owns_transport:
+            self.connection.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     # Annotation methods ##############
     def annotations_list(self, start_date, end_date, response_format=FORMAT_JSON):
         """
@@ -163,29 +250,39 @@ class MixpanelQueryClient(object):
         )
 
     # Event methods ###################
-    def get_events(self, event_names, unit, interval, data_type=DATA_TYPE_UNIQUE, response_format=FORMAT_JSON):
+    def get_events(
+            self, event_names, unit, interval=None, data_type=DATA_TYPE_UNIQUE, response_format=FORMAT_JSON,
+            start_date=None, end_date=None, window_days=None, window_concurrency=4):
         """
         Get unique, total, or average data for a set of events over the last N days,
-        weeks, or months.
+        weeks, or months, or between `start_date` and `end_date` (yyyy-mm-dd, inclusive)
+        instead of the last `interval` units.
 
         Args:
             - See `get_unique_events()` docstring.
+            - `window_days`, `window_concurrency`: See `get_segmentation()`; they require
+              `start_date` and `end_date`.
         Reponse format:
             - See `get_unique_events()` docstring.
         """
         self._validate_unit(unit)
         self._validate_response_format(response_format)
         self._validate_data_type(data_type)
-        return self.connection.request(
-            'events',
-            {
-                'event': event_names,
-                'unit': unit,
-                'interval': interval,
-                'type': data_type,
-            },
-            response_format=response_format
-        )
+        params = {
+            'event': event_names,
+            'unit': unit,
+            'interval': interval,
+            'type': data_type,
+        }
+        if start_date is None and end_date is None:
+            if window_days:
+                raise exceptions.InvalidDateException('`window_days` requires a `start_date` and an `end_date`.')
+            return self.connection.request('events', params, response_format=response_format)
+
+        if self._validate_date(start_date) > self._validate_date(end_date):
+            raise exceptions.InvalidDateException('The `start_date` specified after the `end_date`; you will not receive any events.')
+        params.update({'interval': None, 'from_date': start_date, 'to_date': end_date})
+        return self._windowed_request('events', params, unit, response_format, window_days, window_concurrency)
 
     def get_events_top(self, event_name, limit=10, response_format=FORMAT_JSON):
         """
@@ -444,14 +541,72 @@ class MixpanelQueryClient(object):
             response_format=response_format
         )
 
+    def fetch_all_funnels(
+            self, start_date, end_date,
+            length=14, interval=1, unit=UNIT_DAY, on=None, where=None,
+            concurrency=8, retries=2):
+        """
+        Get the data of every funnel: the funnels are listed once with `get_funnel_list()`, then
+        their details are fetched concurrently, up to `concurrency` at once, so the whole
+        call takes about as long as the slowest funnel rather than the sum of them all.
+
+        Args:
+            - `start_date`, `end_date`, `length`, `interval`, `unit`, `on`, `where`: See
+              `get_funnel_detail()`; they apply to every funnel.
+            - `concurrency`: [int (optional)] The maximum number of funnels fetched at once.
+                             Defaults to 8.
+            - `retries`: [int (optional)] How many times a funnel is retried on its own if it
+                         fails, on top of the client's retry policy. Defaults to 2.
+
+        Returns a generator of `(funnel_id, detail)` pairs, yielded as the funnels complete
+        (ie. not in the order of the funnel list); each detail is the `get_funnel_detail()`
+        response. A funnel still failing after its retries raises, and stopping the iteration
+        early doesn't fetch the remaining funnels.
+
+        > for funnel_id, detail in user_client.fetch_all_funnels('2014-04-01', '2014-04-30'):
+        ...     dashboard.update(funnel_id, detail)
+        """
+        start_date_obj = self._validate_date(start_date)
+        end_date_obj = self._validate_date(end_date)
+        if start_date_obj > end_date_obj:
+            raise exceptions.InvalidDateException('The `start_date` specified after the `end_date`; you will not receive any funnels.')
+
+        funnel_ids = [funnel['funnel_id'] for funnel in self.get_funnel_list()]
+        retry_policy = RetryPolicy(max_retries=retries, backoff_factor=1)
+
+        def _fetch_funnel(funnel_id):
+            detail = retry_policy.call(functools.partial(
+                self.get_funnel_detail, funnel_id, start_date, end_date,
+                length=length, interval=interval, unit=unit, on=on, where=where
+            ))
+            return funnel_id, detail
+        return self._imap(_fetch_funnel, funnel_ids, concurrency, ordered=False)
+
     # Segmentation methods ############
     def get_segmentation(
             self, event_name, start_date, end_date,
             unit=UNIT_DAY, on=None, where=None, limit=None,
-            data_type=DATA_TYPE_UNIQUE, response_format=FORMAT_JSON):
+            data_type=DATA_TYPE_UNIQUE, response_format=FORMAT_JSON,
+            window_days=None, window_concurrency=4):
         """
         Get data for an event, segmented and filtered by properties.
 
+        Long or high resolution ranges (eg. 90 days of hourly data) can be split into
+        windows of `window_days` days, fetched concurrently (up to `window_concurrency` at
+        once) and merged into a response of the same shape as a single call. Each window
+        is retried on its own according to the client's retry policy. Windows require a
+        `unit` of minute, hour or day and the json `response_format`. With `on`, each window
+        keeps its own top segments (`limit`, or Mixpanel's default), so the merged response
+        may hold more; a segment left out of some windows has no value for their dates,
+        rather than a 0.
+
+        When the client has a `series_store`, the days already stored for the same query
+        are not fetched again: only missing days, and the store's `live_days` up to today,
+        are requested (merged into as few ranges as possible) and the response is assembled
+        locally. The same constraints as for windows apply: each stored day keeps the top
+        segments of the range it was fetched with, so a segment has no value for the days
+        fetched while it was left out.
+
         # Example 1
         Suppose Kevin Wood has a website named guidebook.com. He has an event named
         signed up, sent whenever a user signs up to example.com. It has a string
@@ -528,20 +683,17 @@ class MixpanelQueryClient(object):
         if start_date_obj > end_date_obj:
             raise exceptions.InvalidDateException('The `start_date` specified after the `end_date`; you will not receive any annotations.')
 
-        return self.connection.request(
-            'segmentation',
-            {
-                'event': event_name,
-                'from_date': start_date,
-                'to_date': end_date,
-                'unit': unit,
-                'on': on,
-                'where': where,
-                'limit': limit,
-                'type': data_type,
-            },
-            response_format=response_format
-        )
+        params = {
+            'event': event_name,
+            'from_date': start_date,
+            'to_date': end_date,
+            'unit': unit,
+            'on': on,
+            'where': where,
+            'limit': limit,
+            'type': data_type,
+        }
+        return self._windowed_request('segmentation', params, unit, response_format, window_days, window_concurrency)
 
     def get_segmentation_numeric(
             self, event_name, start_date, end_date, on,
@@ -842,7 +994,11 @@ class MixpanelQueryClient(object):
         )
 
     # Export methods ##################
-    def get_export(self, start_date, end_date, event=None, where=None, bucket_id=None, response_format=FORMAT_JSON):
+    def get_export(
+            self, start_date, end_date, event=None, where=None, bucket_id=None,
+            response_format=FORMAT_JSON, stream=False,
+            shard_days=None, shard_concurrency=4, shard_retries=2,
+            parse_processes=None, parse_pool=None, fields=None, predicate=None):
         """
         Get a "raw dump" of tracked events over a time period.
 
@@ -859,6 +1015,37 @@ class MixpanelQueryClient(object):
                                [sample]: ["play song", "log in", "add playlist"]
             `where`: [str] An expression to filter events by.
             `bucket_id`: [str] The specific data bucket you would like to query.
+            `stream`: [bool (optional)] When True, the (gzipped) response is decompressed and parsed
+                      incrementally, keeping memory bounded regardless of the export size. Events
+                      are yielded before the transfer is complete, so a cut-off transfer raises a
+                      `TruncatedResponseException` only after the events received so far.
+                      Defaults to False, which reads the whole response before yielding.
+            `shard_days`: [int (optional)] When set, the date range is split into shards of this many
+                          days which are fetched concurrently, up to `shard_concurrency` at once.
+                          Events are still yielded in chronological order. Each shard is retried up
+                          to `shard_retries` times on its own if it fails, so one failure doesn't
+                          restart the whole export. Each shard is held in memory until it is yielded.
+            `parse_processes`: [int (optional)] When set, lines are parsed in chunks by a pool of this
+                               many worker processes while the response is still being read, instead
+                               of on the calling thread. Events are still yielded in order. The
+                               `json_decoder` of the client must be picklable (the named decoders are),
+                               and scripts must guard their entry point with `if __name__ == '__main__'`
+                               on platforms spawning processes. Only the standard library decoder
+                               gains from it: with a native decoder (orjson, ujson, simdjson), the
+                               workers only run the `predicate` and the lines that pass it are decoded
+                               again here; without a `predicate`, it is ignored with a warning.
+            `parse_pool`: [Pool (optional)] A caller-owned `multiprocessing.Pool` (or any pool with an
+                          `apply_async` method, eg. a `ThreadPool` on free-threaded builds) to parse with
+                          instead; it is left open. `parse_processes` then bounds the chunks in flight
+                          (twice its value), defaulting to the number of CPUs.
+            `fields`: [list (optional)] The names of the properties to keep; every other property
+                      is dropped from each event as soon as it is decoded (in the parse workers when
+                      they decode events, see `parse_processes`), which cuts the memory held per event.
+                      [sample]: ["distinct_id", "time", "mp_country_code"]
+            `predicate`: [callable (optional)] A local filter called with each decoded event (before
+                         `fields` is applied); events for which it returns False are dropped. It
+                         complements `where`, which Mixpanel evaluates server side. Must be picklable
+                         (eg. a module level function) when `parse_processes` is set.
 
         Event format:
             {"event":"Viewed report","properties":{"distinct_id":"foo","time":1329263748,"origin":"invite",
@@ -867,6 +1054,160 @@ class MixpanelQueryClient(object):
             "$referring_domain":"mixpanel.com","$os":"Linux","origin_domain":"mixpanel.com","tab":"stream",
             "$browser":"Chrome","Project ID":"3","mp_country_code":"US"}}
         """
+        export_params = self._export_params(start_date, end_date, event, where, bucket_id)
+        if shard_days:
+            shards = self._date_shards(start_date, end_date, shard_days)
+            lines = self._sharded_export_lines(export_params, response_format, shards, shard_concurrency, shard_retries)
+        else:
+            response = self.connection.raw_request(
+                self.connection.DATA_ENDPOINT,
+                'export',
+                export_params,
+                response_format,
+                headers={'Accept-Encoding': 'gzip'} if stream else None
+            )
+            if stream:
+                lines = _iter_response_lines(response)
+            else:
+                # per mixpanel documentation it is necessary to load
+                # the response in it's entirety before processing:
+                #     > This endpoint uses gzip to compress the transfer;
+                #     > as a result, raw exports should not be processed until
+                #     > the file is received in its entirety.
+                # https://mixpanel.com/docs/api-documentation/exporting-raw-data-you-inserted-into-mixpanel
+                lines = response.read().split(b'\n')
+
+        if fields is not None:
+            fields = tuple(fields)
+        for event in self._parse_export_lines(lines, parse_processes, parse_pool, fields, predicate):
+            yield event
+
+    def get_export_incremental(
+            self, start_date, end_date, checkpoints, event=None, where=None, bucket_id=None,
+            recent_days=1, shard_concurrency=4, shard_retries=2, response_format=FORMAT_JSON):
+        """
+        Get a "raw dump" of tracked events, skipping the days already exported by a
+        previous run.
+
+        The range is fetched one day at a time (see `shard_days` in `get_export()`).
+        Once every event of a day has been consumed, the day is recorded in
+        `checkpoints` for this combination of `event`, `where` and `bucket_id`, and
+        later runs skip it. A run that crashes therefore resumes after the last day
+        it completely consumed. Make sure each event has been durably handled before
+        asking for the next one.
+
+        Args:
+            `start_date`, `end_date`, `event`, `where`, `bucket_id`: See `get_export()`.
+            `checkpoints`: [object] A checkpoint store, eg. `SQLiteCheckpointStore`.
+            `recent_days`: [int (optional)] The last `recent_days` days up to today may still
+                           receive events; they are always fetched and never checkpointed.
+                           Defaults to 1 (today only).
+            `shard_concurrency`, `shard_retries`: See `get_export()`.
+        """
+        export_params = self._export_params(start_date, end_date, event, where, bucket_id)
+        filter_key = self._export_filter_key(export_params)
+        completed = checkpoints.completed(filter_key)
+        first_recent_day = (datetime.date.today() - datetime.timedelta(days=recent_days - 1)).strftime('%Y-%m-%d')
+
+        shards = [
+            shard for shard in self._date_shards(start_date, end_date, 1)
+            if shard[0] not in completed or shard[0] >= first_recent_day
+        ]
+        if not shards:
+            return
+
+        json_loads = self.connection.json_loads
+        fetcher = self._export_shard_fetcher(export_params, response_format, shard_retries)
+        shard_lines = self._imap(fetcher, shards, shard_concurrency)
+        for shard, lines in six.moves.zip(shards, shard_lines):
+            for line in lines:
+                yield json_loads(line)
+            if shard[0] < first_recent_day:
+                checkpoints.mark_complete(shard[0], filter_key)
+
+    def export_to_file(
+            self, path, start_date, end_date, event=None, where=None, bucket_id=None,
+            file_format=None, row_group_size=export.DEFAULT_ROW_GROUP_SIZE):
+        """
+        Write a "raw dump" of tracked events over a time period straight to a file,
+        without ever holding the whole export in memory. Returns the size of the
+        written file in bytes.
+
+        Args:
+            `path`: [str] The file to write. It only appears once the export is complete.
+                    [sample]: "/data/events-2014-04-01.ndjson.gz"
+            `start_date`, `end_date`, `event`, `where`, `bucket_id`: See `get_export()`.
+            `file_format`: [str (optional)] One of:
+                - "ndjson.gz": one JSON event per line, gzipped. Mixpanel's gzipped response is
+                               copied to disk as is, without decoding or re-encoding any event.
+                - "ndjson": one JSON event per line, uncompressed.
+                - "parquet": events are written in row groups of `row_group_size` events, with an
+                             `event` column and one column per property (schema inferred from the
+                             first row group). Requires pyarrow.
+                Defaults to a guess based on the extension of `path`.
+            `row_group_size`: [int (optional)] The number of events per Parquet row group.
+        """
+        file_format = file_format or export.guess_format(path)
+        if file_format not in export.VALID_FORMATS:
+            raise exceptions.InvalidFormatException('The `file_format` specified is invalid. Must be {0}.'.format(export.VALID_FORMATS))
+
+        response = self.connection.raw_request(
+            self.connection.DATA_ENDPOINT,
+            'export',
+            self._export_params(start_date, end_date, event, where, bucket_id),
+            self.FORMAT_JSON,
+            headers={'Accept-Encoding': 'gzip'}
+        )
+        return export.write_export(
+            response, path, file_format, row_group_size=row_group_size, json_loads=self.connection.json_loads)
+
+    # Batch methods ###################
+    def batch(self, specs, concurrency=8):
+        """
+        Run many queries concurrently on the client's executor, up to `concurrency` at once.
+
+        Args:
+            `specs`: [list] `QuerySpec`s describing the client calls to make.
+                     [sample]: [QuerySpec('get_segmentation', 'signed up', '2014-04-01', '2014-04-30'),
+                                QuerySpec('get_funnel_detail', 7509, '2014-04-01', '2014-04-30')]
+            `concurrency`: [int (optional)] The maximum number of queries in flight. Defaults to 8.
+
+        Returns a `BatchResult`: responses and errors are keyed by spec, so a
+        failing query doesn't abort the others, along with the latency of
+        each query and the wall time of the whole batch.
+
+        > result = user_client.batch(specs)
+        > result[specs[0]]
+        {'data': {...}, 'legend_size': 1}
+        > result.errors
+        {QuerySpec('get_funnel_detail', 7509, '2014-04-01', '2014-04-30'): HTTPError(...)}
+        """
+        return run_batch(self, specs, concurrency)
+
+    # Util methods ####################
+    def _imap(self, func, items, concurrency, ordered=True):
+        """
+        Utility method calling `func` on `items` on the shared executor, with at most
+        `concurrency` calls in flight (see `_bounded_imap`). On one of the executor's own
+        threads, `func` is called inline instead, so nested work never waits for a thread.
+        """
+        if getattr(self._worker, 'active', False):
+            return six.moves.map(func, items)
+
+        def _worker_func(item):
+            self._worker.active = True
+            try:
+                return func(item)
+            finally:
+                self._worker.active = False
+        return _bounded_imap(self.executor, _worker_func, items, concurrency, ordered=ordered)
+
+    def _map(self, func, items, concurrency):
+        " Utility method like `_imap`, returning the results as a list. "
+        return list(self._imap(func, items, concurrency))
+
+    def _export_params(self, start_date, end_date, event, where, bucket_id):
+        " Utility method used to validate and build the params of an `export` request. "
         start_date_obj = self._validate_date(start_date)
         end_date_obj = self._validate_date(end_date)
 
@@ -879,32 +1220,177 @@ class MixpanelQueryClient(object):
         if isinstance(event, six.string_types):
             event = [event]
 
-        response = self.connection.raw_request(
-            Connection.DATA_ENDPOINT,
-            'export',
-            {
-                'from_date': start_date,
-                'to_date': end_date,
-                'event': event,
-                'where': where,
-                'bucket': bucket_id,
-            },
-            response_format
+        return {
+            'from_date': start_date,
+            'to_date': end_date,
+            'event': event,
+            'where': where,
+            'bucket': bucket_id,
+        }
+
+    def _date_shards(self, start_date, end_date, shard_days):
+        " Utility method used to split a date range into `(from_date, to_date)` shards of `shard_days` days. "
+        shard_start = self._validate_date(start_date).date()
+        end = self._validate_date(end_date).date()
+        shards = []
+        while shard_start <= end:
+            shard_end = min(shard_start + datetime.timedelta(days=shard_days - 1), end)
+            shards.append((shard_start.strftime('%Y-%m-%d'), shard_end.strftime('%Y-%m-%d')))
+            shard_start = shard_end + datetime.timedelta(days=1)
+        return shards
+
+    def _windowed_request(self, method_name, params, unit, response_format, window_days, concurrency):
+        """
+        Utility method requesting the `from_date`-`to_date` range of `params` in windows of
+        `window_days` days, fetched concurrently, and merging their series. Without
+        `window_days` (or with a single window), this is a plain request.
+        """
+        if (self.series_store is not None and 'from_date' in params and unit in self.WINDOWABLE_UNITS and
+                response_format == self.FORMAT_JSON):
+            return self._stored_series_request(method_name, params, unit, response_format, window_days, concurrency)
+        return self._fetch_windows(method_name, params, unit, response_format, window_days, concurrency)
+
+    def _fetch_windows(self, method_name, params, unit, response_format, window_days, concurrency):
+        " Utility method behind `_windowed_request`, which never touches the `series_store`. "
+        windows = self._request_windows(params, unit, response_format, window_days)
+        if len(windows) <= 1:
+            return self.connection.request(method_name, params, response_format=response_format)
+
+        def _fetch_window(window):
+            window_params = dict(params, from_date=window[0], to_date=window[1])
+            return self.connection.request(method_name, window_params, response_format=response_format)
+
+        return _merge_series(self._map(_fetch_window, windows, concurrency))
+
+    def _request_windows(self, params, unit, response_format, window_days):
+        """
+        Utility method validating `window_days` and returning the `(from_date, to_date)`
+        windows of `params`, or an empty list without `window_days`.
+        """
+        if not window_days:
+            return []
+        if unit not in self.WINDOWABLE_UNITS:
+            raise exceptions.InvalidUnitException('`window_days` requires a `unit` in {0}.'.format(self.WINDOWABLE_UNITS))
+        if response_format != self.FORMAT_JSON:
+            raise exceptions.InvalidFormatException('`window_days` requires the `json` response format.')
+        return self._date_shards(params['from_date'], params['to_date'], window_days)
+
+    def _stored_series_request(self, method_name, params, unit, response_format, window_days, concurrency):
+        """
+        Utility method assembling a series response from the days held by the `series_store`,
+        fetching only the missing and live days (each contiguous run of them as one range,
+        itself split in windows when `window_days` is given).
+        """
+        store = self.series_store
+        key = self._series_key(method_name, params)
+        days = [shard[0] for shard in self._date_shards(params['from_date'], params['to_date'], 1)]
+        today = getattr(store, 'today', datetime.date.today)()
+        first_live_day = (today - datetime.timedelta(days=store.live_days - 1)).strftime('%Y-%m-%d')
+
+        records = store.get(key, [day for day in days if day < first_live_day])
+        runs = []
+        for day in days:
+            if day in records:
+                continue
+            if runs and runs[-1][-1] == self._previous_day(day):
+                runs[-1].append(day)
+            else:
+                runs.append([day])
+        if not runs:
+            return _merge_series([records[day] for day in days])
+
+        def _fetch_run(run):
+            run_params = dict(params, from_date=run[0], to_date=run[-1])
+            response = self._fetch_windows(method_name, run_params, unit, response_format, window_days, concurrency)
+            return _split_series_by_day(response, run)
+
+        fetched = [_fetch_run(runs[0])] if len(runs) == 1 else self._map(_fetch_run, runs, concurrency)
+        for run_records in fetched:
+            store.set(key, dict((day, record) for day, record in six.iteritems(run_records) if day < first_live_day))
+            records.update(run_records)
+        return _merge_series([records[day] for day in days])
+
+    def _series_key(self, method_name, params):
+        " Utility method identifying a series query in the `series_store`, regardless of its dates. "
+        filters = dict(
+            (key, value) for key, value in six.iteritems(params)
+            if key not in ('from_date', 'to_date') and value
         )
-        # per mixpanel documentation it is necessary to load
-        # the response in it's entirety before processing:
-        #     > This endpoint uses gzip to compress the transfer;
-        #     > as a result, raw exports should not be processed until
-        #     > the file is received in its entirety.
-        # https://mixpanel.com/docs/api-documentation/exporting-raw-data-you-inserted-into-mixpanel
-        response_data = response.read()
-        lines = _totext(response_data).split('\n')
-        
-        for line in lines:
-            if line:
-                yield json.loads(line)
+        canonical = json.dumps([self.api_key, method_name, filters], sort_keys=True)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def _previous_day(self, day):
+        return (datetime.datetime.strptime(day, '%Y-%m-%d') - datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+
+    def _sharded_export_lines(self, export_params, response_format, shards, concurrency, retries):
+        " Utility method fetching export shards concurrently and yielding their lines in order. "
+        fetcher = self._export_shard_fetcher(export_params, response_format, retries)
+        for lines in self._imap(fetcher, shards, concurrency):
+            for line in lines:
+                yield line
+
+    def _parse_export_lines(self, lines, parse_processes, parse_pool, fields=None, predicate=None):
+        """
+        Utility method decoding, filtering and projecting export lines in order, either on the
+        calling thread or, when `parse_processes` or `parse_pool` is given, in chunks on a pool of workers.
+        """
+        json_loads = self.connection.json_loads
+        # a native decoder parses lines faster than decoded events can be unpickled, so its
+        # worker processes only run the `predicate` and send back the raw lines that passed it
+        filter_only = parse_pool is None and _is_native_decoder(json_loads)
+        if parse_processes and filter_only and predicate is None:
+            warnings.warn(
+                '`parse_processes` is ignored with a native JSON decoder and no `predicate`: it only '
+                'pays off with the standard library decoder, or to run a selective `predicate`.',
+                RuntimeWarning, stacklevel=3)
+            parse_processes = None
+        if not parse_processes and parse_pool is None:
+            for event in _decode_events(json_loads, lines, fields, predicate):
+                yield event
+            return
+
+        pool = parse_pool if parse_pool is not None else multiprocessing.Pool(processes=parse_processes)
+        window = 2 * (parse_processes or multiprocessing.cpu_count())
+        chunks = _chunked((line for line in lines if line), self.EXPORT_PARSE_CHUNK_LINES)
+        if filter_only:
+            parse_chunk = functools.partial(_filter_lines, json_loads, predicate)
+        else:
+            parse_chunk = functools.partial(_parse_lines, json_loads, fields, predicate)
+        try:
+            for chunk in _bounded_imap(pool, parse_chunk, chunks, window):
+                for event in (_decode_events(json_loads, chunk, fields, None) if filter_only else chunk):
+                    yield event
+        finally:
+            if parse_pool is None:
+                # discards any chunk still in flight when iteration stopped early
+                pool.terminate()
+
+    def _export_shard_fetcher(self, export_params, response_format, retries):
+        " Utility method returning a function which fetches the lines of one shard of an export. "
+        retry_policy = RetryPolicy(max_retries=retries, backoff_factor=1)
+
+        def _fetcher_func(shard):
+            params = dict(export_params, from_date=shard[0], to_date=shard[1])
+            def _fetch_shard():
+                response = self.connection.raw_request(
+                    self.connection.DATA_ENDPOINT,
+                    'export',
+                    params.copy(),
+                    response_format,
+                    headers={'Accept-Encoding': 'gzip'}
+                )
+                return list(_iter_response_lines(response))
+            return retry_policy.call(_fetch_shard)
+        return _fetcher_func
+
+    def _export_filter_key(self, export_params):
+        " Utility method identifying the project and filters of an export, regardless of its dates. "
+        filters = dict(
+            (key, value) for key, value in six.iteritems(export_params)
+            if key not in ('from_date', 'to_date') and value
+        )
+        return json.dumps([self.api_key, filters], sort_keys=True)
 
-    # Util methods ####################
     def _validate_unit(self, unit):
         " Utility method used to validate a `unit` param. "
         if unit not in self.VALID_UNITS:
@@ -2,11 +2,18 @@
 The class(es) in this module contain logic to make http
 requests to the Mixpanel API.
 """
+import datetime
+import hashlib
 import json
+import time
 
 import six
 
-from six.moves.urllib import request as url_request
+from mixpanel_query.cache import SingleFlight
+from mixpanel_query.decoders import get_decoder
+from mixpanel_query.instrumentation import MeteredResponse, RequestMetrics
+from mixpanel_query.retry import RetryPolicy
+from mixpanel_query.transport import HTTPTransport
 
 __all__ = ('Connection',)
 
@@ -14,28 +21,182 @@ class Connection(object):
     """
     The `Connection` object's sole responsibility is to format, send to
     and parse http responses from the Mixpanel API.
+
+    Requests are sent through `transport`, which defaults to an
+    `HTTPTransport` keeping connections to the API hosts alive; a transport
+    provides `open(request_obj, timeout, idempotent=True)` and `close()`. When a
+    `cache` (see `mixpanel_query.cache`) is given, responses of read-only
+    query endpoints are served from it when possible, and identical queries
+    issued concurrently share a single round trip.
+
+    Failed requests are retried according to `retry_policy` (a `RetryPolicy`
+    by default; pass `RetryPolicy(max_retries=0)` to disable retries), except
+    for `WRITE_METHODS`, which may have been applied even though their
+    response was lost and are therefore sent only once. An
+    optional `rate_limiter` paces the requests of every thread using the
+    connection.
+
+    Responses are decoded with `json_decoder` (see `mixpanel_query.decoders`),
+    the fastest installed JSON library by default.
+
+    When a `collector` (see `mixpanel_query.instrumentation`) is given, the
+    `RequestMetrics` of every request are reported to it.
     """
     ENDPOINT = 'https://mixpanel.com/api'
     DATA_ENDPOINT = 'https://data.mixpanel.com/api'
     VERSION = '2.0'
     DEFAULT_TIMEOUT = 120
 
-    def __init__(self, client):
+    # methods whose responses are never cached
+    UNCACHEABLE_METHODS = ('engage',)
+    # write methods, mapped to the cached methods whose results they change
+    WRITE_METHODS = {
+        'annotations/create': ('annotations',),
+        'annotations/update': ('annotations',),
+        'annotations/delete': ('annotations',),
+    }
+
+    def __init__(
+            self, client, transport=None, cache=None, retry_policy=None, rate_limiter=None, json_decoder=None,
+            collector=None):
         self.client = client
+        self.transport = transport if transport is not None else HTTPTransport()
+        self.cache = cache
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.json_loads = get_decoder(json_decoder)
+        self.collector = collector
+        self._single_flight = SingleFlight()
 
     def request(self, method_name, params, response_format='json'):
         """
         Make a request to Mixpanel query endpoints and return the
         parsed response.
         """
-        request = self.raw_request(self.ENDPOINT, method_name, params, response_format)
-        data = request.read()
-        return json.loads(data.decode('utf-8'))
+        if self.collector is None:
+            return self.json_loads(self._request_data(method_name, params, response_format))
+
+        metrics = RequestMetrics(method_name)
+        try:
+            data = self._request_data(method_name, params, response_format, metrics)
+            started = time.time()
+            result = self.json_loads(data)
+            metrics.timings['decode'] = time.time() - started
+            return result
+        except Exception as e:
+            metrics.failed(e)
+            raise
+        finally:
+            metrics.finish()
+            self.collector.on_request(metrics)
+
+    def _request_data(self, method_name, params, response_format, metrics=None):
+        """
+        Return the body of a query's response, from the cache when possible.
+        """
+        if self.cache is None or method_name in self.UNCACHEABLE_METHODS:
+            return self.raw_request(self.ENDPOINT, method_name, params, response_format, metrics=metrics).read()
+        elif method_name in self.WRITE_METHODS:
+            data = self.raw_request(self.ENDPOINT, method_name, params, response_format, metrics=metrics).read()
+            for invalidated_method in self.WRITE_METHODS[method_name]:
+                self.cache.invalidate(invalidated_method)
+            return data
+
+        key = self.cache_key(method_name, params, response_format)
+        data = self.cache.get(key)
+        if data is None:
+            data = self._single_flight.do(
+                key,
+                lambda: self._fetch_and_cache(key, method_name, params, response_format, metrics)
+            )
+        return data
+
+    def _fetch_and_cache(self, key, method_name, params, response_format, metrics=None):
+        data = self.raw_request(self.ENDPOINT, method_name, params, response_format, metrics=metrics).read()
+        self.cache.set(key, method_name, data, self.cache_ttl(params))
+        return data
+
+    def cache_key(self, method_name, params, response_format):
+        """
+        Return the key identifying a request in the cache: a hash of the
+        method name, the project's api key and the (non-empty) params.
+        """
+        key_params = dict((key, value) for key, value in six.iteritems(params) if value)
+        key_params['format'] = response_format
+        canonical = json.dumps([method_name, self.client.api_key, key_params], sort_keys=True)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
 
-    def raw_request(self, base_url, method_name, params, response_format):
+    def cache_ttl(self, params):
+        """
+        Responses for date ranges that ended before today no longer change and
+        are cached indefinitely; everything else uses the cache's default ttl.
+        """
+        to_date = params.get('to_date')
+        if to_date:
+            try:
+                end_date = datetime.datetime.strptime(to_date[:10], '%Y-%m-%d').date()
+            except ValueError:
+                pass
+            else:
+                if end_date < datetime.date.today():
+                    return None
+        return self.cache.default_ttl
+
+    def raw_request(self, base_url, method_name, params, response_format, headers=None, metrics=None):
         """
         Make a request to the Mixpanel API and return a raw urllib2/url.request file-like
         response object.
+
+        Any `headers` passed are added to the authenticated request. With a
+        `collector`, the request is measured into `metrics` when given (for the
+        caller to report), or else reported once the response is consumed.
+        Write methods are sent at most once: neither retried nor re-sent by the
+        transport on a stale keep-alive connection.
+        """
+        idempotent = method_name not in self.WRITE_METHODS
+
+        def _open():
+            # each attempt is signed anew, so it doesn't expire while backing off
+            request_obj = self.build_request(base_url, method_name, params.copy(), response_format, headers)
+            if self.rate_limiter is None:
+                return self.transport.open(request_obj, self.effective_timeout(), idempotent=idempotent)
+            # the request holds its slot until its response has been consumed
+            self.rate_limiter.acquire()
+            try:
+                response = self.transport.open(request_obj, self.effective_timeout(), idempotent=idempotent)
+            except Exception:
+                self.rate_limiter.release()
+                raise
+            return self.rate_limiter.limit_response(response)
+        retry_call = self.retry_policy.call if idempotent else _call_once
+        if self.collector is None:
+            return retry_call(_open)
+        return self._metered_request(_open, method_name, metrics, retry_call)
+
+    def _metered_request(self, open_func, method_name, metrics, retry_call):
+        collector = None
+        if metrics is None:
+            metrics, collector = RequestMetrics(method_name), self.collector
+
+        def _attempt():
+            metrics.attempts += 1
+            return open_func()
+
+        try:
+            response = retry_call(_attempt)
+        except Exception as e:
+            if collector is not None:
+                metrics.failed(e)
+                metrics.finish()
+                collector.on_request(metrics)
+            raise
+        metrics.status = response.getcode()
+        metrics.timings.update(getattr(response, 'timings', None) or {})
+        return MeteredResponse(response, metrics, collector)
+
+    def build_request(self, base_url, method_name, params, response_format, headers=None):
+        """
+        Return the authenticated request object for an API call.
         """
         params['format'] = response_format
         # Getting rid of the None params
@@ -46,8 +207,12 @@ class Connection(object):
             method_name=method_name,
         )
         request_obj = self.client.auth.authenticate(url_without_params, params)
-        effective_timeout = self.DEFAULT_TIMEOUT if self.client.timeout is None else self.client.timeout
-        return url_request.urlopen(request_obj, timeout=effective_timeout)
+        for header, value in six.iteritems(headers or {}):
+            request_obj.add_header(header, value)
+        return request_obj
+
+    def effective_timeout(self):
+        return self.DEFAULT_TIMEOUT if self.client.timeout is None else self.client.timeout
 
     def check_params(self, params):
         copyParams = params.copy()
@@ -56,3 +221,8 @@ class Connection(object):
                 del params[key]
 
         return params
+
+
+def _call_once(func):
+    " `RetryPolicy.call` for requests which must not be retried. "
+    return func()
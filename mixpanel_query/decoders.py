@@ -0,0 +1,87 @@
+"""
+The functions in this module pick the JSON decoder used to parse responses;
+see the `json_decoder` argument of `MixpanelQueryClient`.
+
+A decoder is any callable taking the raw (UTF-8 encoded) bytes of a JSON
+document and returning the decoded object. Decoding straight from bytes
+avoids building an intermediate text copy of every response and export line.
+
+The fastest installed backend is used by default, in the order of
+`DECODERS`. None of them is a dependency of this library; install one
+separately (eg. `pip install orjson`) to speed up large exports.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+__all__ = ('DECODERS', 'available_decoders', 'get_decoder')
+
+DECODERS = ('orjson', 'ujson', 'simdjson', 'json')
+# the packages to install for each decoder, where they differ from its name
+_PACKAGES = {'simdjson': 'pysimdjson'}
+
+
+def _stdlib_loads(data):
+    # decoding to text first is faster than letting `json.loads` detect the
+    # encoding of bytes, and works before Python 3.6 too
+    return json.loads(data.decode('utf-8'))
+
+
+def _backends():
+    backends = {
+        'json': _stdlib_loads,
+    }
+    if orjson is not None:
+        backends['orjson'] = orjson.loads
+    if ujson is not None:
+        backends['ujson'] = ujson.loads
+    if simdjson is not None:
+        backends['simdjson'] = simdjson.loads
+    return backends
+
+
+def _is_native_decoder(loads):
+    """
+    Whether `loads` is one of the native backends, which decode a line faster
+    than another process could send the decoded event back.
+    """
+    return any(loads is backend for name, backend in _backends().items() if name != 'json')
+
+
+def available_decoders():
+    " Return the names of the installed decoders, fastest first. "
+    backends = _backends()
+    return [name for name in DECODERS if name in backends]
+
+
+def get_decoder(decoder=None):
+    """
+    Return a callable decoding JSON bytes.
+
+    `decoder` may be the name of one of `DECODERS`, a callable (returned as
+    is), or None for the fastest installed backend.
+    """
+    if callable(decoder):
+        return decoder
+    backends = _backends()
+    if decoder is None:
+        return backends[available_decoders()[0]]
+    if decoder not in DECODERS:
+        raise ValueError('The `json_decoder` specified is invalid. Must be a callable or one of {0}.'.format(DECODERS))
+    if decoder not in backends:
+        raise ImportError('The `{0}` JSON decoder is not installed; `pip install {1}`.'.format(
+            decoder, _PACKAGES.get(decoder, decoder)))
+    return backends[decoder]
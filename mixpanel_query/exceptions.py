@@ -24,3 +24,11 @@ class InvalidDateException(MixpanelQueryException):
 class InvalidDataType(MixpanelQueryException):
     " The data type you have specified is invalid. "
     pass
+
+class TruncatedResponseException(MixpanelQueryException):
+    " The response body ended before it was complete (eg. a cut-off gzip stream). "
+    pass
+
+class PoolClosedException(MixpanelQueryException):
+    " The thread pool running a concurrent operation was shut down (eg. by `close()`) before it completed. "
+    pass
@@ -0,0 +1,215 @@
+"""
+The functions in this module write the raw `/export` stream straight to
+disk; see `MixpanelQueryClient.export_to_file()`.
+
+Files are written to `<path>.part` and renamed into place once the export is
+complete, so a failed export never leaves a truncated file behind.
+"""
+import gzip
+import json
+import os
+import zlib
+
+import six
+
+from mixpanel_query.utils import DEFAULT_CHUNK_SIZE, GZIP_MAGIC, _iter_response_lines
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+__all__ = ('FORMAT_NDJSON', 'FORMAT_NDJSON_GZ', 'FORMAT_PARQUET', 'guess_format', 'write_export')
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_NDJSON_GZ = 'ndjson.gz'
+FORMAT_PARQUET = 'parquet'
+VALID_FORMATS = (FORMAT_NDJSON, FORMAT_NDJSON_GZ, FORMAT_PARQUET)
+
+DEFAULT_ROW_GROUP_SIZE = 100000
+# properties which don't fit the inferred schema are kept, JSON encoded, in this column
+EXTRA_PROPERTIES_COLUMN = '_extra_properties'
+
+
+def guess_format(path):
+    " Guess the output format from the extension of `path`. "
+    if path.endswith('.parquet'):
+        return FORMAT_PARQUET
+    if path.endswith('.gz'):
+        return FORMAT_NDJSON_GZ
+    return FORMAT_NDJSON
+
+
+def write_export(
+        response, path, file_format, chunk_size=DEFAULT_CHUNK_SIZE, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+        json_loads=json.loads):
+    """
+    Write an `/export` response to `path` in `file_format` and return the
+    number of bytes written. Only `chunk_size` bytes (or one row group, for
+    Parquet) are held in memory at a time. Parquet rows are decoded from
+    JSON bytes with `json_loads`.
+    """
+    partial_path = path + '.part'
+    try:
+        if file_format == FORMAT_PARQUET:
+            _write_parquet(response, partial_path, row_group_size, json_loads)
+        else:
+            with open(partial_path, 'wb') as output:
+                _write_ndjson(response, output, file_format == FORMAT_NDJSON_GZ, chunk_size)
+        os.rename(partial_path, path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    finally:
+        response.close()
+    return os.path.getsize(path)
+
+
+def _write_ndjson(response, output, compress, chunk_size):
+    """
+    Copy the body to `output`. A gzipped body written to a gzipped file is
+    copied byte for byte, without ever being decompressed.
+    """
+    chunk = response.read(chunk_size)
+    while chunk and len(chunk) < len(GZIP_MAGIC):
+        more = response.read(chunk_size)
+        if not more:
+            break
+        chunk += more
+    gzipped = chunk[:2] == GZIP_MAGIC
+
+    if gzipped == compress:
+        sink = output
+    elif compress:
+        sink = gzip.GzipFile(fileobj=output, mode='wb')
+    else:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        sink = _DecompressingWriter(output, decompressor)
+
+    while chunk:
+        sink.write(chunk)
+        chunk = response.read(chunk_size)
+    if sink is not output:
+        sink.close()
+
+
+class _DecompressingWriter(object):
+    def __init__(self, output, decompressor):
+        self.output = output
+        self.decompressor = decompressor
+
+    def write(self, chunk):
+        self.output.write(self.decompressor.decompress(chunk))
+
+    def close(self):
+        self.output.write(self.decompressor.flush())
+
+
+def _write_parquet(response, path, row_group_size, json_loads):
+    """
+    Parse the events and write them in row groups of `row_group_size`. The
+    schema is inferred from the properties of the first row group: an
+    `event` column plus one column per property.
+    """
+    if pyarrow is None:
+        raise ImportError('Writing Parquet requires pyarrow; `pip install pyarrow`.')
+
+    writer = None
+    schema = None
+    batch = []
+    try:
+        for line in _iter_response_lines(response):
+            batch.append(json_loads(line))
+            if len(batch) >= row_group_size:
+                if writer is None:
+                    schema = _infer_schema(batch)
+                    writer = pyarrow.parquet.ParquetWriter(path, schema)
+                writer.write_table(_to_table(batch, schema))
+                batch = []
+        if writer is None:
+            schema = _infer_schema(batch)
+            writer = pyarrow.parquet.ParquetWriter(path, schema)
+        if batch:
+            writer.write_table(_to_table(batch, schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _column_kind(values):
+    " The kind of column able to hold every (non null) sample in `values`. "
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add('bool')
+        elif isinstance(value, six.integer_types + (float,)):
+            kinds.add('float')
+        else:
+            kinds.add('string')
+    return kinds.pop() if len(kinds) == 1 else 'string'
+
+
+_ARROW_TYPES = {
+    'bool': lambda: pyarrow.bool_(),
+    'float': lambda: pyarrow.float64(),
+    'string': lambda: pyarrow.string(),
+}
+
+
+def _infer_schema(events):
+    samples = {}
+    for event in events:
+        for key, value in six.iteritems(event.get('properties') or {}):
+            samples.setdefault(key, []).append(value)
+
+    fields = [pyarrow.field('event', pyarrow.string())]
+    for key in sorted(samples):
+        if key in ('event', EXTRA_PROPERTIES_COLUMN):
+            continue
+        field = pyarrow.field(key, _ARROW_TYPES[_column_kind(samples[key])]())
+        field = field.with_metadata({b'kind': _column_kind(samples[key]).encode('utf-8')})
+        fields.append(field)
+    fields.append(pyarrow.field(EXTRA_PROPERTIES_COLUMN, pyarrow.string()))
+    return pyarrow.schema(fields)
+
+
+def _fits(kind, value):
+    if kind == 'bool':
+        return isinstance(value, bool)
+    if kind == 'float':
+        return isinstance(value, six.integer_types + (float,)) and not isinstance(value, bool)
+    return True
+
+
+def _to_table(events, schema):
+    " Build a row group, moving properties that don't fit the schema to the extra column. "
+    kinds = dict(
+        (field.name, field.metadata[b'kind'].decode('utf-8'))
+        for field in schema if field.metadata
+    )
+    columns = dict((name, []) for name in schema.names)
+    for event in events:
+        properties = event.get('properties') or {}
+        extra = {}
+        for key, value in six.iteritems(properties):
+            if value is None:
+                continue
+            kind = kinds.get(key)
+            if kind is None or not _fits(kind, value):
+                extra[key] = value
+        columns['event'].append(event.get('event'))
+        for name, kind in six.iteritems(kinds):
+            value = properties.get(name)
+            if name in extra or value is None:
+                value = None
+            elif kind == 'string' and not isinstance(value, six.string_types):
+                value = json.dumps(value)
+            elif kind == 'float':
+                value = float(value)
+            columns[name].append(value)
+        columns[EXTRA_PROPERTIES_COLUMN].append(json.dumps(extra) if extra else None)
+    return pyarrow.Table.from_arrays([pyarrow.array(columns[field.name], type=field.type) for field in schema], schema=schema)
@@ -0,0 +1,207 @@
+"""
+The classes in this module report how the requests to the Mixpanel API
+performed; see the `collector` argument of `MixpanelQueryClient`.
+
+A collector is any object providing:
+    `on_request(metrics)`: called with the `RequestMetrics` of every request
+                           once it has completed (or failed).
+
+Without a collector, requests are not measured at all.
+"""
+import logging
+import time
+
+from six.moves.urllib import error as url_error
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+__all__ = ('RequestMetrics', 'LoggingCollector', 'PrometheusCollector')
+
+# request phases, in the order they happen
+PHASES = ('dns', 'connect', 'tls', 'server', 'download', 'decode')
+
+
+class RequestMetrics(object):
+    """
+    Measurements of one API call:
+        `endpoint`: the API method called, eg. "funnels" or "export".
+        `status`: the HTTP status of the response, if any.
+        `attempts`: the number of times the request was sent (0 when served from the cache).
+        `bytes_received`: the size of the response body as transferred (ie. compressed).
+        `error`: the exception the request failed with, if any.
+        `timings`: seconds spent in each of `PHASES`, for the phases which took place:
+            `dns`, `connect`, `tls`: resolving and connecting, when a new connection was opened.
+            `server`: sending the request until the response headers arrived.
+            `download`: reading the response body.
+            `decode`: parsing the JSON response (not measured for exports, which are
+                      decoded as they are consumed).
+        `duration`: seconds from the first attempt until the response was consumed,
+                    including retries and their backoff.
+    Transport phases are those of the last attempt, and are only measured by
+    `HTTPTransport`.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.status = None
+        self.attempts = 0
+        self.bytes_received = 0
+        self.error = None
+        self.timings = {}
+        self.duration = None
+        self._started = time.time()
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    @property
+    def cached(self):
+        return self.attempts == 0 and self.error is None
+
+    def failed(self, error):
+        " Record the `error` the request failed with. "
+        self.error = error
+        if isinstance(error, url_error.HTTPError):
+            self.status = error.code
+
+    def finish(self):
+        self.duration = time.time() - self._started
+
+    def __repr__(self):
+        return '<RequestMetrics {0} status={1} attempts={2} bytes={3} duration={4}>'.format(
+            self.endpoint, self.status, self.attempts, self.bytes_received, self.duration)
+
+
+class MeteredResponse(object):
+    """
+    Wraps a raw response to time the reading of its body and count its
+    bytes. Once the body has been read to the end (or the response closed),
+    the metrics are finished and, if a `collector` is given, reported.
+    """
+
+    def __init__(self, response, metrics, collector=None):
+        self._response = response
+        self._metrics = metrics
+        self._collector = collector
+        self._done = False
+
+    def read(self, amt=None):
+        started = time.time()
+        data = self._response.read() if amt is None else self._response.read(amt)
+        metrics = self._metrics
+        metrics.timings['download'] = metrics.timings.get('download', 0.0) + time.time() - started
+        metrics.bytes_received += len(data)
+        if amt is None or not data:
+            self._finish()
+        return data
+
+    def close(self):
+        self._response.close()
+        self._finish()
+
+    def _finish(self):
+        if self._done:
+            return
+        self._done = True
+        self._metrics.finish()
+        if self._collector is not None:
+            self._collector.on_request(self._metrics)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LoggingCollector(object):
+    """
+    Logs one line per request to `logger` (the `mixpanel_query` logger by
+    default) at `level`, eg.
+
+        funnels status=200 attempts=1 bytes=18231 duration=0.412s dns=0.004s connect=0.021s ...
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger if logger is not None else logging.getLogger('mixpanel_query')
+        self.level = level
+
+    def on_request(self, metrics):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        timings = ''.join(
+            ' {0}={1:.3f}s'.format(phase, metrics.timings[phase])
+            for phase in PHASES if phase in metrics.timings
+        )
+        self.logger.log(
+            self.level,
+            '%s status=%s attempts=%d bytes=%d duration=%.3fs%s%s',
+            metrics.endpoint,
+            metrics.status,
+            metrics.attempts,
+            metrics.bytes_received,
+            metrics.duration or 0.0,
+            timings,
+            ' error={0!r}'.format(metrics.error) if metrics.error is not None else ''
+        )
+
+
+class PrometheusCollector(object):
+    """
+    Exports requests as Prometheus metrics, labelled by endpoint:
+        `<namespace>_requests_total` (also by status: an HTTP status, "cached" or "error")
+        `<namespace>_retries_total`
+        `<namespace>_response_bytes_total`
+        `<namespace>_request_duration_seconds` (histogram)
+        `<namespace>_request_phase_seconds` (histogram, also by phase)
+
+    Requires prometheus_client; `pip install prometheus_client`. Metrics are
+    registered in `registry`, the default registry unless given.
+    """
+
+    def __init__(self, registry=None, namespace='mixpanel_query', buckets=None):
+        if prometheus_client is None:
+            raise ImportError('`PrometheusCollector` requires prometheus_client; `pip install prometheus_client`.')
+
+        registry = registry if registry is not None else prometheus_client.REGISTRY
+        histogram_options = {'buckets': buckets} if buckets is not None else {}
+        self.requests = prometheus_client.Counter(
+            'requests_total', 'Requests to the Mixpanel API.', ['endpoint', 'status'],
+            namespace=namespace, registry=registry)
+        self.retries = prometheus_client.Counter(
+            'retries_total', 'Retried requests to the Mixpanel API.', ['endpoint'],
+            namespace=namespace, registry=registry)
+        self.response_bytes = prometheus_client.Counter(
+            'response_bytes_total', 'Bytes received from the Mixpanel API.', ['endpoint'],
+            namespace=namespace, registry=registry)
+        self.duration = prometheus_client.Histogram(
+            'request_duration_seconds', 'Duration of Mixpanel API requests, retries included.', ['endpoint'],
+            namespace=namespace, registry=registry, **histogram_options)
+        self.phases = prometheus_client.Histogram(
+            'request_phase_seconds', 'Duration of each phase of Mixpanel API requests.', ['endpoint', 'phase'],
+            namespace=namespace, registry=registry, **histogram_options)
+
+    def on_request(self, metrics):
+        endpoint = metrics.endpoint
+        if metrics.cached:
+            status = 'cached'
+        elif metrics.status is not None:
+            status = str(metrics.status)
+        else:
+            status = 'error'
+        self.requests.labels(endpoint, status).inc()
+        if metrics.retries:
+            self.retries.labels(endpoint).inc(metrics.retries)
+        if metrics.bytes_received:
+            self.response_bytes.labels(endpoint).inc(metrics.bytes_received)
+        if metrics.duration is not None:
+            self.duration.labels(endpoint).observe(metrics.duration)
+        for phase, seconds in metrics.timings.items():
+            self.phases.labels(endpoint, phase).observe(seconds)
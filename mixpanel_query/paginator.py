@@ -1,8 +1,150 @@
+import collections
+import functools
+import inspect
 import math
 import itertools
+import sys
+import threading
+import time
 from multiprocessing.pool import ThreadPool
 import six
-from six.moves import range
+from six.moves import queue, range
+from six.moves.urllib import error as url_error
+
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.retry import RetryPolicy, retry_listener
+from mixpanel_query.utils import _bounded_imap, _submit
+
+
+class AdaptiveConcurrency(object):
+    """
+    Picks the number of page requests to keep in flight, AIMD-style (additive
+    increase, multiplicative decrease), between `min_concurrency` and
+    `max_concurrency`.
+
+    The concurrency grows by one for every `concurrency` pages fetched without
+    congestion. It is multiplied by `decrease_ratio` (at most once per window
+    of in-flight pages) when a page fails with a transient error (a 429,
+    timeout, 5xx...), including the attempts the connection retried on its
+    own (see `record_retry`), or when the moving average of page latencies
+    exceeds `latency_tolerance` times the fastest page seen so far, since
+    server-side queueing shows up as latency too.
+    """
+    # weight of each new latency sample in the moving average
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, min_concurrency=1, max_concurrency=20, initial_concurrency=4,
+                 decrease_ratio=0.5, latency_tolerance=3.0):
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = max(min_concurrency, min(initial_concurrency, max_concurrency))
+        self.decrease_ratio = decrease_ratio
+        self.latency_tolerance = latency_tolerance
+
+        self.pages = 0
+        self.results = 0
+        self.errors = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.peak_concurrency = self.concurrency
+        self.elapsed = 0.0
+        self._total_latency = 0.0
+        self._min_latency = None
+        self._avg_latency = None
+        self._increase_credit = 0.0
+        self._since_decrease = 0
+        self._retry_policy = RetryPolicy()
+        self._lock = threading.Lock()
+
+    def record(self, latency, results=0, error=None):
+        """
+        Record a page fetched in `latency` seconds, with `results` results or
+        the `error` it failed with, and adjust the concurrency.
+        """
+        with self._lock:
+            self.pages += 1
+            self.results += results
+            self._total_latency += latency
+            self._since_decrease += 1
+
+            if error is not None:
+                congested = self._record_error(error)
+            else:
+                if self._min_latency is None:
+                    self._min_latency = self._avg_latency = latency
+                self._min_latency = min(self._min_latency, latency)
+                self._avg_latency += (latency - self._avg_latency) * self.LATENCY_SMOOTHING
+                congested = self._avg_latency > self._min_latency * self.latency_tolerance
+
+            if congested:
+                self._decrease()
+            elif error is None:
+                self._increase_credit += 1.0 / self.concurrency
+                if self._increase_credit >= 1 and self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+                    self._increase_credit = 0.0
+                    self.peak_concurrency = max(self.peak_concurrency, self.concurrency)
+
+    def record_retry(self, error):
+        """
+        Record a failed attempt which is about to be retried (eg. by the
+        connection's `RetryPolicy`) while fetching a page, and adjust the
+        concurrency; the page itself is recorded by `record` once it completes.
+        """
+        with self._lock:
+            if self._record_error(error):
+                self._decrease()
+
+    def is_transient(self, error):
+        " Whether a page which failed with `error` may succeed if it's fetched again. "
+        return self._retry_policy.is_retryable(error)
+
+    def _record_error(self, error):
+        self.errors += 1
+        if isinstance(error, url_error.HTTPError) and error.code == 429:
+            self.throttled += 1
+        return self._retry_policy.is_retryable(error)
+
+    def _decrease(self):
+        # the pages already in flight were sent at the old concurrency; only react once to them
+        if self._since_decrease >= self.concurrency:
+            self.concurrency = max(self.min_concurrency, int(self.concurrency * self.decrease_ratio))
+            self.decreases += 1
+            self._since_decrease = 0
+            self._increase_credit = 0.0
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the controller: the current and peak `concurrency`, the
+        number of `pages`, `results`, `errors` (failed attempts, retried or not,
+        of which `throttled` were 429s) and `decreases`, the mean page latency and the throughput in pages and
+        results per second of fetching.
+        """
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'peak_concurrency': self.peak_concurrency,
+                'pages': self.pages,
+                'results': self.results,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'decreases': self.decreases,
+                'mean_latency': self._total_latency / self.pages if self.pages else None,
+                'pages_per_second': self.pages / self.elapsed if self.elapsed else None,
+                'results_per_second': self.results / self.elapsed if self.elapsed else None,
+            }
+
+def _returns_coroutines(func, owner):
+    """
+    Whether `func` is an `async def` function, or a method of a client whose
+    connection is asynchronous (eg. `AsyncMixpanelQueryClient.get_engage`).
+    """
+    iscoroutinefunction = getattr(inspect, 'iscoroutinefunction', None)
+    if iscoroutinefunction is None:
+        return False
+    connection = getattr(owner, 'connection', None)
+    return iscoroutinefunction(func) or iscoroutinefunction(getattr(connection, 'request', None))
 
 class ConcurrentPaginator(object):
     """
@@ -13,17 +155,57 @@ class ConcurrentPaginator(object):
     pagination.
     """
 
-    def __init__(self, get_func, concurrency=20):
+    # how many times an adaptive paginator requeues a page failing with a transient error
+    ADAPTIVE_PAGE_RETRIES = 3
+
+    def __init__(self, get_func, concurrency=20, pool=None, adaptive=False, min_concurrency=1):
         """
         Initialize with a function that fetches a page of results.
         `concurrency` controls the number of threads used to fetch pages.
 
+        When `adaptive` is True, `concurrency` is only an upper bound: the
+        number of pages in flight is tuned between `min_concurrency` and
+        `concurrency` from the latency and errors of the pages fetched (see
+        `AdaptiveConcurrency`), and carries over to later calls. The chosen
+        concurrency and the throughput are reported by `stats`. A page failing
+        with a transient error is put back in the queue, after the concurrency
+        has been reduced, up to `ADAPTIVE_PAGE_RETRIES` times.
+
+        The thread pool is created on demand and reused across `fetch_all`
+        calls until `close()` is called. Alternatively, an existing
+        `multiprocessing.pool.ThreadPool` may be passed in via `pool`; it is
+        left open for its owner to close. When `get_func` is a method of a
+        `MixpanelQueryClient`, the client's shared executor is used by default.
+
         Example:
             client = MixpanelQueryClient(...)
-            ConcurrentPaginator(client.get_engage, concurrency=10)
+            with ConcurrentPaginator(client.get_engage, concurrency=10) as paginator:
+                profiles = paginator.fetch_all()
         """
+        owner = getattr(get_func, '__self__', None)
+        if _returns_coroutines(get_func, owner):
+            raise TypeError(
+                '`{0}` needs a function returning pages, not coroutines; '
+                'page through an `AsyncMixpanelQueryClient` with `await`.'.format(type(self).__name__))
         self.get_func = get_func
         self.concurrency = concurrency
+        # the client's executor is looked up on every use, as `client.close()` replaces it
+        self._client = owner if pool is None and isinstance(owner, MixpanelQueryClient) else None
+        self._pool = pool
+        self._owns_pool = pool is None and self._client is None
+        self._pool_size = 0
+        # outgrown pools, which iterators started earlier may still be using
+        self._retired_pools = []
+        self._pool_lock = threading.Lock()
+        self.controller = AdaptiveConcurrency(min_concurrency, concurrency) if adaptive else None
+
+    @property
+    def stats(self):
+        """
+        The statistics of the adaptive controller (see `AdaptiveConcurrency.stats`),
+        or None when the paginator is not adaptive.
+        """
+        return self.controller.stats if self.controller is not None else None
 
     def fetch_all(self, params=None):
         """
@@ -34,13 +216,85 @@ class ConcurrentPaginator(object):
         """
         params = params and params.copy() or {}
 
-        first_page = self.get_func(**params)
+        first_page = self._fetch_first_page(params)
         results = first_page['results']
         params['session_id'] = first_page['session_id']
 
         start, end = self._remaining_page_range(first_page)
+        if end <= start:
+            return results
         fetcher = self._results_fetcher(params)
-        return results + self._concurrent_flatmap(fetcher, list(range(start, end)))
+        if self.controller is not None:
+            remaining_pages = self._adaptive_imap(fetcher, range(start, end), ordered=True)
+        else:
+            pool = self._get_pool(end - start)
+            remaining_pages = _bounded_imap(pool, fetcher, range(start, end), self.concurrency)
+        return results + list(itertools.chain.from_iterable(remaining_pages))
+
+    def iter_all(self, params=None, ordered=True, pages=False):
+        """
+        Lazily fetch all results from all pages, yielding each result as soon
+        as its page arrives. At most `concurrency` pages are in flight at any
+        time, so memory stays bounded by the pages not yet consumed.
+
+        Pages are yielded in page order when `ordered` is True; set it to False
+        to yield them in the order they complete, for maximum throughput. When
+        `pages` is True, whole pages (lists of results) are yielded instead of
+        individual results.
+        """
+        params = params and params.copy() or {}
+
+        first_page = self._fetch_first_page(params)
+        params['session_id'] = first_page['session_id']
+        start, end = self._remaining_page_range(first_page)
+
+        page_results = [first_page['results']]
+        if end > start:
+            fetcher = self._results_fetcher(params)
+            if self.controller is not None:
+                remaining_pages = self._adaptive_imap(fetcher, range(start, end), ordered=ordered)
+            else:
+                pool = self._get_pool(end - start)
+                remaining_pages = _bounded_imap(pool, fetcher, range(start, end), self.concurrency, ordered=ordered)
+            page_results = itertools.chain(page_results, remaining_pages)
+
+        for results in page_results:
+            if pages:
+                yield results
+            else:
+                for result in results:
+                    yield result
+
+    def close(self):
+        """
+        Shut down the thread pools owned by the paginator, if any.
+        """
+        if not self._owns_pool:
+            # a caller-supplied pool (or the client's executor) stays in use
+            return
+        with self._pool_lock:
+            pools = self._retired_pools + ([self._pool] if self._pool is not None else [])
+            self._pool, self._pool_size, self._retired_pools = None, 0, []
+        for pool in pools:
+            pool.close()
+            pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _fetch_first_page(self, params):
+        """
+        Fetch the first page, which tells how many pages there are. When adaptive,
+        it is retried like the other pages and its failed attempts reach the controller.
+        """
+        if self.controller is None:
+            return self.get_func(**params)
+        page_retry_policy = RetryPolicy(max_retries=self.ADAPTIVE_PAGE_RETRIES)
+        with retry_listener(self.controller.record_retry):
+            return page_retry_policy.call(functools.partial(self.get_func, **params))
 
     def _results_fetcher(self, params):
         def _fetcher_func(page):
@@ -48,11 +302,153 @@ class ConcurrentPaginator(object):
             return self.get_func(**req_params)['results']
         return _fetcher_func
 
-    def _concurrent_flatmap(self, func, iterable):
-        pool = ThreadPool(processes=self.concurrency)
-        return list(itertools.chain(*pool.map(func, iterable)))
+    def _get_pool(self, num_tasks):
+        """
+        Return a pool with enough threads for `num_tasks` (up to
+        `concurrency`), growing the owned pool only when needed so a handful
+        of remaining pages don't spin up `concurrency` threads. An outgrown
+        pool is only shut down by `close()`, as another call may still be
+        submitting pages to it.
+        """
+        if self._client is not None:
+            return self._client.executor
+        size = max(1, min(self.concurrency, num_tasks))
+        with self._pool_lock:
+            if not self._owns_pool:
+                return self._pool
+            if self._pool is not None and self._pool_size < size:
+                self._retired_pools.append(self._pool)
+                self._pool = None
+            if self._pool is None:
+                self._pool = ThreadPool(processes=size)
+                self._pool_size = size
+            return self._pool
+
+    def _adaptive_imap(self, func, pages, ordered):
+        """
+        Like `_bounded_imap`, but the number of pages in flight (or fetched and
+        waiting to be yielded in order) follows the adaptive controller, which
+        also hears of the attempts retried by the connection. Pages failing
+        with a transient error are requeued (ahead of the pages not sent yet)
+        after a backoff, up to `ADAPTIVE_PAGE_RETRIES` times each.
+        """
+        controller = self.controller
+        pages = list(pages)
+        if not pages:
+            return
+        pool = self._get_pool(len(pages))
+        page_retry_policy = RetryPolicy(max_retries=self.ADAPTIVE_PAGE_RETRIES)
+        done = queue.Queue()
+
+        def _call(entry):
+            index, delay = entry
+            time.sleep(delay)
+            started = time.time()
+            try:
+                with retry_listener(controller.record_retry):
+                    results = func(pages[index])
+            except Exception as e:
+                controller.record(time.time() - started, error=e)
+                done.put((index, False, sys.exc_info()))
+            else:
+                controller.record(time.time() - started, results=len(results))
+                done.put((index, True, results))
+
+        queued = collections.deque((index, 0.0) for index in range(len(pages)))
+        attempts = collections.Counter()
+        next_yield = 0
+        in_flight = 0
+        buffered = {}
+        started = time.time()
+        try:
+            while next_yield < len(pages):
+                # a requeued page may be the one holding back the buffered pages: never stall
+                while queued and (in_flight + len(buffered) < controller.concurrency or not in_flight):
+                    _submit(pool, _call, queued.popleft())
+                    in_flight += 1
+
+                index, succeeded, value = done.get()
+                in_flight -= 1
+                if not succeeded:
+                    error = value[1]
+                    if attempts[index] < page_retry_policy.max_retries and controller.is_transient(error):
+                        queued.appendleft((index, page_retry_policy.backoff(attempts[index], error)))
+                        attempts[index] += 1
+                        continue
+                    six.reraise(*value)
+                if not ordered:
+                    next_yield += 1
+                    yield value
+                    continue
+                buffered[index] = value
+                while next_yield in buffered:
+                    yield buffered.pop(next_yield)
+                    next_yield += 1
+        finally:
+            controller.elapsed += time.time() - started
 
     def _remaining_page_range(self, response):
         num_pages = math.ceil(response['total'] / float(response['page_size']))
         return (response['page'] + 1, int(num_pages))
 
+
+class LazyPaginator(ConcurrentPaginator):
+    """
+    Fetches the pages of a paginated collection only as fast as they are
+    consumed, for callers which may not need every page.
+
+    At most `prefetch` pages are requested ahead of the page being consumed
+    (0 fetches each page on demand). No further page is requested once the
+    consumer stops iterating or `limit` results have been yielded, which
+    saves API quota when only the first matches are wanted.
+
+    Example:
+        client = MixpanelQueryClient(...)
+        with LazyPaginator(client.get_engage, prefetch=2) as paginator:
+            for profile in paginator.iter_all({'where': 'properties["plan"] == "pro"'}, limit=50):
+                ...
+    """
+
+    def __init__(self, get_func, prefetch=2, pool=None):
+        super(LazyPaginator, self).__init__(get_func, concurrency=max(prefetch, 1), pool=pool)
+        self.prefetch = prefetch
+
+    def iter_all(self, params=None, limit=None, pages=False):
+        """
+        Lazily yield the results of every page, in page order, stopping after
+        `limit` results when it is given. When `pages` is True, whole pages
+        (lists of results) are yielded instead of individual results.
+        """
+        if limit is not None and limit <= 0:
+            return
+        params = params and params.copy() or {}
+
+        first_page = self.get_func(**params)
+        params['session_id'] = first_page['session_id']
+        start, end = self._remaining_page_range(first_page)
+        if limit is not None and first_page['page_size']:
+            # never request a page past the one holding the `limit`th result
+            end = min(end, first_page['page'] + int(math.ceil(limit / float(first_page['page_size']))))
+
+        page_results = [first_page['results']]
+        if end > start:
+            fetcher = self._results_fetcher(params)
+            if self.prefetch:
+                pool = self._get_pool(end - start)
+                remaining_pages = _bounded_imap(pool, fetcher, range(start, end), self.prefetch)
+            else:
+                remaining_pages = six.moves.map(fetcher, range(start, end))
+            page_results = itertools.chain(page_results, remaining_pages)
+
+        remaining = limit
+        for results in page_results:
+            if remaining is not None:
+                results = results[:remaining]
+                remaining -= len(results)
+            if pages:
+                yield results
+            else:
+                for result in results:
+                    yield result
+            if remaining == 0:
+                return
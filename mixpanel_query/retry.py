@@ -0,0 +1,207 @@
+"""
+The classes in this module control how requests to the Mixpanel API are
+retried when they fail, and how fast they are issued in the first place.
+"""
+import contextlib
+import email.utils
+import random
+import socket
+import threading
+import time
+
+from six.moves import http_client
+from six.moves.urllib import error as url_error
+
+from mixpanel_query.exceptions import TruncatedResponseException
+
+__all__ = ('RetryPolicy', 'RateLimiter', 'retry_listener')
+
+_listeners = threading.local()
+
+
+@contextlib.contextmanager
+def retry_listener(callback):
+    """
+    Within the block, call `callback(error)` with every error a `RetryPolicy`
+    is about to retry on the current thread, eg. the 429s absorbed by the
+    connection while fetching a page.
+    """
+    previous = getattr(_listeners, 'callback', None)
+    _listeners.callback = callback
+    try:
+        yield
+    finally:
+        _listeners.callback = previous
+
+
+class RetryPolicy(object):
+    """
+    Retries failed requests with exponential backoff and full jitter.
+
+    Network errors and responses with one of `retry_statuses` are retried up
+    to `max_retries` times. The n-th retry waits a random duration between 0
+    and `min(max_backoff, backoff_factor * 2 ** n)` seconds, unless the
+    response carried a `Retry-After` header, which is honored instead.
+
+    Example:
+        client = MixpanelQueryClient(API_KEY, API_SECRET, retry_policy=RetryPolicy(max_retries=5))
+    """
+    DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_retries=3, backoff_factor=0.5, max_backoff=60, jitter=True,
+                 retry_statuses=DEFAULT_RETRY_STATUSES):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = retry_statuses
+
+    def is_retryable(self, error):
+        " Whether the request that raised `error` may succeed if it's sent again. "
+        if isinstance(error, url_error.HTTPError):
+            return error.code in self.retry_statuses
+        return isinstance(error, (
+            url_error.URLError, http_client.HTTPException, socket.error, TruncatedResponseException
+        ))
+
+    def backoff(self, attempt, error=None):
+        " The number of seconds to wait before retry number `attempt` (starting at 0). "
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        backoff = min(self.max_backoff, self.backoff_factor * (2 ** attempt))
+        return random.uniform(0, backoff) if self.jitter else backoff
+
+    def call(self, func):
+        """
+        Call `func` until it succeeds, raises a non retryable error or the
+        retries are exhausted, and return its result.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not self.is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                listener = getattr(_listeners, 'callback', None)
+                if listener is not None:
+                    listener(e)
+            time.sleep(delay)
+            attempt += 1
+
+    def _retry_after(self, error):
+        " Parse the `Retry-After` header (delta-seconds or http-date) of an `HTTPError`, if any. "
+        headers = getattr(error, 'headers', None)
+        value = headers.get('Retry-After') if headers is not None else None
+        if not value:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is None:
+                return None
+            return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+
+class RateLimiter(object):
+    """
+    A token bucket shared by every thread issuing requests through the same
+    client: requests are sent at most `rate` times per `per` seconds (with
+    bursts of up to `burst` requests), and at most `max_concurrent` of them
+    are in progress at any time, from sending the request until its
+    response has been read to the end or closed (see `limit_response`).
+
+    Example (Mixpanel allows 60 queries per hour, 5 at a time):
+        limiter = RateLimiter(60, per=3600, max_concurrent=5)
+        client = MixpanelQueryClient(API_KEY, API_SECRET, rate_limiter=limiter)
+    """
+
+    def __init__(self, rate, per=1.0, burst=None, max_concurrent=None):
+        self.rate = float(rate) / per
+        self.burst = burst if burst is not None else max(1, rate)
+        self.max_concurrent = max_concurrent
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def acquire(self):
+        " Block until a request may be sent. Must be paired with `release()`. "
+        if self._slots is not None:
+            self._slots.acquire()
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def release(self):
+        if self._slots is not None:
+            self._slots.release()
+
+    def limit_response(self, response):
+        """
+        Wrap the `response` of a request sent after `acquire()` so that the
+        request is released once its body has been read or it is closed.
+        """
+        return RateLimitedResponse(response, self.release)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class RateLimitedResponse(object):
+    """
+    Wraps a raw response to call `release` once, when its body has been read
+    to the end or the response is closed.
+    """
+
+    def __init__(self, response, release):
+        self._response = response
+        self._release = release
+        self._done = False
+        self._lock = threading.Lock()
+
+    def read(self, amt=None):
+        try:
+            data = self._response.read() if amt is None else self._response.read(amt)
+        except Exception:
+            self._finish()
+            raise
+        if amt is None or not data:
+            self._finish()
+        return data
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self._release()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
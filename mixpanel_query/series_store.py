@@ -0,0 +1,108 @@
+"""
+The classes in this module keep the results of `get_segmentation` and
+`get_events` day by day, so that overlapping date ranges (eg. a sliding "last
+30 days" window) only fetch the days not stored yet; see the `series_store`
+argument of `MixpanelQueryClient`.
+
+A series store is any object providing:
+    `get(key, days)`: return `{day: record}` for the days of `days` (yyyy-mm-dd)
+                      stored under `key`.
+    `set(key, records)`: store `{day: record}` under `key`.
+    `live_days`: the number of days, up to and including today, whose results may
+                 still change; they are always fetched and never stored.
+    `today()`: (optional) return today's `datetime.date` in the timezone of the
+               Mixpanel project. Defaults to the local date of the machine.
+
+A record is the part of a `{'data': {'series': [...], 'values': {...}}}`
+response covering a single day. With `on`, it only holds the top segments of
+the range it was fetched with.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+
+__all__ = ('MemorySeriesStore', 'SQLiteSeriesStore')
+
+
+class MemorySeriesStore(object):
+    """
+    Keeps per-day results in process memory, for as long as the store lives.
+    `today` returns the current date; when the project's timezone differs from
+    the machine's, pass eg. `lambda: datetime.datetime.now(project_tz).date()`
+    so the `live_days` are the project's most recent days.
+
+    Example:
+        client = MixpanelQueryClient(API_KEY, API_SECRET, series_store=MemorySeriesStore())
+    """
+    DEFAULT_LIVE_DAYS = 1
+
+    def __init__(self, live_days=DEFAULT_LIVE_DAYS, today=datetime.date.today):
+        self.live_days = live_days
+        self.today = today
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, days):
+        with self._lock:
+            records = self._records.get(key, {})
+            return dict((day, records[day]) for day in days if day in records)
+
+    def set(self, key, records):
+        with self._lock:
+            self._records.setdefault(key, {}).update(records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+class SQLiteSeriesStore(object):
+    """
+    Keeps per-day results in a local SQLite file, so they survive restarts and
+    can be shared by several processes. `today`: see `MemorySeriesStore`.
+
+    Example:
+        store = SQLiteSeriesStore('/var/cache/mixpanel-series.sqlite')
+        client = MixpanelQueryClient(API_KEY, API_SECRET, series_store=store)
+    """
+    DEFAULT_LIVE_DAYS = 1
+
+    def __init__(self, path, live_days=DEFAULT_LIVE_DAYS, today=datetime.date.today):
+        self.path = path
+        self.live_days = live_days
+        self.today = today
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS series_days ('
+                'key TEXT, day TEXT, record TEXT, PRIMARY KEY (key, day))'
+            )
+
+    def get(self, key, days):
+        days = list(days)
+        if not days:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT day, record FROM series_days WHERE key = ? AND day BETWEEN ? AND ?',
+                (key, min(days), max(days))
+            ).fetchall()
+        wanted = set(days)
+        return dict((day, json.loads(record)) for day, record in rows if day in wanted)
+
+    def set(self, key, records):
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO series_days VALUES (?, ?, ?)',
+                [(key, day, json.dumps(record)) for day, record in records.items()]
+            )
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM series_days')
+
+    def close(self):
+        with self._lock:
+            self._db.close()
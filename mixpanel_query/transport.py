@@ -0,0 +1,339 @@
+"""
+The classes in this module are responsible for sending the request objects
+built by the auth classes over the wire and returning file-like responses.
+"""
+import base64
+import functools
+import io
+import socket
+import threading
+import time
+
+import six
+
+from six.moves import http_client, queue
+from six.moves.urllib import error as url_error
+from six.moves.urllib import parse as url_parse
+from six.moves.urllib import request as url_request
+
+__all__ = ('UrllibTransport', 'HTTPTransport')
+
+
+class UrllibTransport(object):
+    """
+    Opens a brand new connection (and TLS session) for every request via
+    `urlopen`. Mostly useful when a custom opener is installed globally
+    through urllib.
+    """
+
+    def open(self, request_obj, timeout, idempotent=True):
+        return url_request.urlopen(request_obj, timeout=timeout)
+
+    def close(self):
+        pass
+
+
+class PooledResponse(object):
+    """
+    Wraps an `HTTPResponse` so that its connection is handed back to the pool
+    once the body has been fully read, or discarded if the response is closed
+    before that.
+    """
+
+    def __init__(self, response, url, release, timings=None):
+        self._response = response
+        self._release = release
+        self.url = url
+        # seconds spent in each phase of the request before the body is read
+        self.timings = timings if timings is not None else {}
+        self.status = self.code = response.status
+        self.reason = self.msg = response.reason
+        self.headers = response.msg
+
+    def read(self, amt=None):
+        data = self._response.read() if amt is None else self._response.read(amt)
+        if self._response.isclosed():
+            self._finish(reusable=True)
+        return data
+
+    def close(self):
+        reusable = self._response.isclosed()
+        self._response.close()
+        self._finish(reusable)
+
+    def _finish(self, reusable):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(reusable and not self._response.will_close)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.status
+
+    def geturl(self):
+        return self.url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _timed_create_connection(timings, address, timeout, source_address=None):
+    """
+    `socket.create_connection`, recording the time spent resolving the host
+    (`dns`) and opening the TCP connection (`connect`) in `timings`.
+    """
+    host, port = address
+    started = time.time()
+    addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    resolved = time.time()
+    timings['dns'] = resolved - started
+
+    error = None
+    for _, _, _, _, sockaddr in addresses:
+        try:
+            sock = socket.create_connection(sockaddr[:2], timeout, source_address)
+        except socket.error as e:
+            error = e
+            continue
+        timings['connect'] = time.time() - resolved
+        return sock
+    raise error if error is not None else socket.error('getaddrinfo returned an empty list')
+
+
+class HTTPConnectionPool(object):
+    """
+    Keeps up to `maxsize` idle keep-alive connections to a single host. When
+    more requests than that are in flight, the extra connections are opened
+    as needed and closed once their response has been consumed.
+
+    With a `proxy` (an http:// url, optionally with credentials), plain http
+    requests are sent to the proxy, and https connections are tunneled
+    through it with CONNECT.
+    """
+
+    def __init__(self, scheme, host, port, maxsize, proxy=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.maxsize = maxsize
+        self._idle = queue.LifoQueue(maxsize)
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self.proxy = None
+        self._proxy_headers = {}
+        if proxy:
+            self.proxy = url_parse.urlsplit(proxy if '//' in proxy else '//' + proxy)
+            if self.proxy.username is not None:
+                credentials = '{0}:{1}'.format(
+                    url_parse.unquote(self.proxy.username), url_parse.unquote(self.proxy.password or ''))
+                self._proxy_headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(
+                    credentials.encode('utf-8')).decode('ascii')
+
+    def _new_conn(self, timeout):
+        if self.proxy is None:
+            if self.scheme == 'https':
+                return http_client.HTTPSConnection(self.host, self.port, timeout=timeout)
+            return http_client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+        proxy_port = self.proxy.port or 80
+        if self.scheme == 'https':
+            conn = http_client.HTTPSConnection(self.proxy.hostname, proxy_port, timeout=timeout)
+            conn.set_tunnel(self.host, self.port, headers=self._proxy_headers)
+            return conn
+        return http_client.HTTPConnection(self.proxy.hostname, proxy_port, timeout=timeout)
+
+    def _get_conn(self, timeout):
+        """
+        Returns an idle connection if there is one, or a new connection. The
+        second value tells whether the connection has been used before.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            return self._new_conn(timeout), False
+
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _put_conn(self, conn):
+        # a connection released once the pool is closed (eg. by a response still being
+        # read during `HTTPTransport.close()`) is closed rather than kept idle
+        with self._close_lock:
+            if not self._closed:
+                try:
+                    self._idle.put_nowait(conn)
+                    return
+                except queue.Full:
+                    pass
+        conn.close()
+
+    def _connect(self, conn, timings):
+        """
+        Open a new connection, recording the `dns`, `connect` and (for https)
+        `tls` phases in `timings`.
+        """
+        # python 2's httplib always calls `socket.create_connection`; `connect` then includes `dns`
+        conn._create_connection = functools.partial(_timed_create_connection, timings)
+        started = time.time()
+        conn.connect()
+        elapsed = time.time() - started
+        if 'connect' not in timings:
+            timings['connect'] = elapsed
+        elif self.scheme == 'https':
+            timings['tls'] = max(0.0, elapsed - timings['dns'] - timings['connect'])
+
+    def urlopen(self, method, selector, headers, timeout, idempotent=True):
+        """
+        Issue a request and return the `HTTPResponse` together with the
+        connection it was read from and the timings of the request's phases
+        (see `PooledResponse.timings`). A connection that went stale while
+        idle is retried once on a fresh connection. Requests which are not
+        `idempotent` are never sent twice: they always open a fresh
+        connection, since a failure on a reused one can't tell whether the
+        server acted on the request.
+        """
+        if self.proxy is not None and self.scheme == 'http':
+            # a plain http proxy is sent the absolute url
+            netloc = self.host if self.port is None else '{0}:{1}'.format(self.host, self.port)
+            selector = 'http://{0}{1}'.format(netloc, selector)
+            headers = dict(headers, **self._proxy_headers)
+        conn, reused = self._get_conn(timeout) if idempotent else (self._new_conn(timeout), False)
+        while True:
+            timings = {}
+            try:
+                if conn.sock is None:
+                    self._connect(conn, timings)
+                started = time.time()
+                conn.request(method, selector, headers=headers)
+                response = conn.getresponse()
+                timings['server'] = time.time() - started
+                return conn, response, timings
+            except socket.timeout:
+                conn.close()
+                raise
+            except (http_client.HTTPException, socket.error):
+                conn.close()
+                if not reused:
+                    raise
+                conn, reused = self._new_conn(timeout), False
+
+    def release(self, conn, reusable):
+        if reusable:
+            self._put_conn(conn)
+        else:
+            conn.close()
+
+    def close(self):
+        with self._close_lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class HTTPTransport(object):
+    """
+    Sends requests over persistent keep-alive connections, so consecutive
+    queries to the same host skip the TCP and TLS handshakes.
+
+    `pool_size` is the number of idle connections kept per host;
+    `pool_sizes` overrides it for specific hosts, keyed either by host or by
+    base url (eg. `Connection.DATA_ENDPOINT`).
+
+    Like `urlopen`, requests go through the proxies of the environment
+    (`HTTP_PROXY`, `HTTPS_PROXY`, honoring `NO_PROXY`) unless `proxies` is
+    given: a `{scheme: proxy url}` dict, empty to connect directly. Only
+    http:// proxies are supported.
+
+    Example:
+        transport = HTTPTransport(pool_size=20, pool_sizes={Connection.DATA_ENDPOINT: 2})
+        client = MixpanelQueryClient(API_KEY, API_SECRET, transport=transport)
+    """
+    DEFAULT_POOL_SIZE = 10
+    MAX_REDIRECTS = 5
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_sizes=None, proxies=None):
+        self.pool_size = pool_size
+        self._environment_proxies = proxies is None
+        self.proxies = url_request.getproxies() if proxies is None else proxies
+        self.pool_sizes = dict(
+            (url_parse.urlsplit(key).netloc or key, size)
+            for key, size in six.iteritems(pool_sizes or {})
+        )
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                parsed = url_parse.urlsplit('//' + netloc)
+                pool = HTTPConnectionPool(
+                    scheme,
+                    parsed.hostname,
+                    parsed.port,
+                    self.pool_sizes.get(netloc, self.pool_size),
+                    proxy=self._proxy_for(scheme, parsed.hostname),
+                )
+                self._pools[key] = pool
+            return pool
+
+    def _proxy_for(self, scheme, host):
+        proxy = self.proxies.get(scheme)
+        if proxy and self._environment_proxies and url_request.proxy_bypass(host):
+            return None
+        return proxy
+
+    def open(self, request_obj, timeout, idempotent=True):
+        """
+        Issue the request and return a file-like response. Like `urlopen`,
+        redirects are followed and error statuses raise an `HTTPError`.
+        Requests which are not `idempotent` are sent at most once.
+        """
+        url = request_obj.get_full_url()
+        method = request_obj.get_method()
+        headers = dict(request_obj.header_items())
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            parsed = url_parse.urlsplit(url)
+            selector = parsed.path or '/'
+            if parsed.query:
+                selector = '{0}?{1}'.format(selector, parsed.query)
+
+            pool = self._get_pool(parsed.scheme, parsed.netloc)
+            conn, response, timings = pool.urlopen(method, selector, headers, timeout, idempotent)
+            release = lambda reusable, pool=pool, conn=conn: pool.release(conn, reusable)
+            pooled_response = PooledResponse(response, url, release, timings)
+
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                pooled_response.read()
+                url = url_parse.urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                body = pooled_response.read()
+                raise url_error.HTTPError(url, response.status, response.reason, response.msg, io.BytesIO(body))
+            return pooled_response
+
+        raise url_error.HTTPError(url, response.status, 'Too many redirects', response.msg, None)
+
+    def close(self):
+        """
+        Close every idle connection held by the transport. The connections of responses
+        still being read are closed once they are released; later requests open new ones.
+        """
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
@@ -1,8 +1,16 @@
+import collections
+import itertools
 import json
+import re
+import sys
+import zlib
 
 import six
 
-from six.moves.urllib.parse import urlencode
+from six.moves import queue
+from six.moves.urllib.parse import quote_plus
+
+from mixpanel_query.exceptions import PoolClosedException, TruncatedResponseException
 
 
 def _totext(val):
@@ -39,11 +47,230 @@ def _unicode_urlencode(params):
     unicode URL parameters.
     """
     if isinstance(params, dict):
-        params = list(six.iteritems(params))
-    for i, param in enumerate(params):
-        if isinstance(param[1], list):
-            params[i] = (param[0], json.dumps(param[1]),)
-
-    return urlencode(
-        [(_tobytes(k), _tobytes(v)) for k, v in params]
-    )
+        params = _serialize_params(params)
+    else:
+        params = [(_totext(key), _param_text(value)) for key, value in params]
+    return _urlencode_pairs(params)
+
+def _urlencode_pairs(pairs):
+    " Encode `(key, value)` pairs already serialized to text into a query string. "
+    return u'&'.join([_quote(key) + u'=' + _quote(value) for key, value in pairs])
+
+_URL_SAFE = re.compile(r'^[A-Za-z0-9_.~-]*$')
+
+def _quote(text):
+    " `quote_plus` a text value, skipping the work for values which need no escaping. "
+    if _URL_SAFE.match(text):
+        return text
+    return quote_plus(text.encode('utf-8'))
+
+def _param_text(value):
+    " Serialize a single param value to text; lists are JSON encoded. "
+    if isinstance(value, six.text_type):
+        return value
+    elif isinstance(value, list):
+        return json.dumps(value)
+    elif isinstance(value, six.binary_type):
+        return value.decode('utf-8')
+    return six.text_type(value)
+
+def _serialize_params(params):
+    """
+    Serialize every param of a dict to text exactly once and return the
+    `(key, value)` pairs sorted by key, ready to be both signed and encoded.
+    """
+    return sorted((_totext(key), _param_text(value)) for key, value in six.iteritems(params))
+
+GZIP_MAGIC = b'\x1f\x8b'
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+class _LineSplitter(object):
+    """
+    Splits a (possibly gzip-compressed) body into lines as chunks of it are
+    fed in. Compression is detected by the gzip magic number at the start of
+    the body (chunks are held back until its first two bytes are in), so at
+    most one decompressed chunk plus a partial line is held in memory at any
+    time.
+    """
+
+    def __init__(self):
+        self._decompressor = None
+        self._pending = b''
+        self._started = False
+
+    def feed(self, chunk):
+        " Returns the complete, non-empty lines made available by `chunk`. "
+        if not self._started:
+            chunk = self._pending + chunk
+            self._pending = b''
+            if len(chunk) < len(GZIP_MAGIC):
+                self._pending = chunk
+                return []
+            self._started = True
+            if chunk[:2] == GZIP_MAGIC:
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._decompressor is not None:
+            chunk = self._decompressor.decompress(chunk)
+        lines = (self._pending + chunk).split(b'\n')
+        self._pending = lines.pop()
+        return [line for line in lines if line]
+
+    def finish(self):
+        " Returns the remaining lines once the whole body has been fed. "
+        tail = self._pending
+        self._pending = b''
+        if self._decompressor is not None:
+            # `eof` is not available on py2 decompressors; skip the check there
+            if not getattr(self._decompressor, 'eof', True):
+                raise TruncatedResponseException('The gzip response body ended before it was complete.')
+            tail += self._decompressor.flush()
+        return [line for line in tail.split(b'\n') if line]
+
+def _iter_response_lines(response, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Incrementally read a file-like http response and yield each non-empty
+    line as a binary string, transparently decompressing gzip bodies.
+    """
+    splitter = _LineSplitter()
+    try:
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            for line in splitter.feed(chunk):
+                yield line
+        for line in splitter.finish():
+            yield line
+    finally:
+        response.close()
+
+def _submit(pool, func, item):
+    " Submit `func(item)` to `pool`, raising `PoolClosedException` once the pool has been shut down. "
+    try:
+        return pool.apply_async(func, (item,))
+    except (ValueError, AssertionError):
+        # py3 pools raise a ValueError when they are no longer running, py2 pools fail an assertion
+        raise PoolClosedException(
+            'The thread pool was shut down (eg. by `close()`) while this operation was still running.')
+
+def _bounded_imap(pool, func, iterable, window, ordered=True):
+    """
+    Like `pool.imap`, but never has more than `window` calls of `func` in
+    flight and only pulls items from `iterable` as room frees up. Results are
+    yielded in the order of `iterable` when `ordered`, or as soon as they
+    complete otherwise. Closing the generator stops further submissions; once
+    `pool` is shut down, the calls already in flight complete, but the next
+    submission raises `PoolClosedException`.
+    """
+    items = iter(iterable)
+
+    if ordered:
+        pending = collections.deque(
+            _submit(pool, func, item) for item in itertools.islice(items, window)
+        )
+        while pending:
+            result = pending.popleft().get()
+            for item in itertools.islice(items, window - len(pending)):
+                pending.append(_submit(pool, func, item))
+            yield result
+        return
+
+    done = queue.Queue()
+
+    def _call(item):
+        try:
+            done.put((True, func(item)))
+        except Exception:
+            done.put((False, sys.exc_info()))
+
+    in_flight = 0
+    for item in itertools.islice(items, window):
+        _submit(pool, _call, item)
+        in_flight += 1
+    while in_flight:
+        succeeded, value = done.get()
+        in_flight -= 1
+        if not succeeded:
+            six.reraise(*value)
+        for item in itertools.islice(items, window - in_flight):
+            _submit(pool, _call, item)
+            in_flight += 1
+        yield value
+
+def _chunked(iterable, size):
+    " Yield lists of up to `size` consecutive items of `iterable`. "
+    items = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _decode_events(json_loads, lines, fields=None, predicate=None):
+    """
+    Decode non-empty export lines into events, dropping the events rejected
+    by `predicate` and, when `fields` is given, every property not in it.
+    """
+    for line in lines:
+        if not line:
+            continue
+        event = json_loads(line)
+        if predicate is not None and not predicate(event):
+            continue
+        if fields is not None:
+            properties = event.get('properties') or {}
+            event['properties'] = dict((field, properties[field]) for field in fields if field in properties)
+        yield event
+
+def _parse_lines(json_loads, fields, predicate, lines):
+    " Decode a chunk of export lines; runs in the worker processes of a parse pool. "
+    return list(_decode_events(json_loads, lines, fields, predicate))
+
+def _filter_lines(json_loads, predicate, lines):
+    """
+    Keep the export lines whose event passes `predicate`; runs in the worker
+    processes of a parse pool when the caller decodes faster than it could
+    unpickle decoded events.
+    """
+    return [line for line in lines if predicate(json_loads(line))]
+
+def _merge_series(responses):
+    """
+    Merge `{'data': {'series': [...], 'values': {segment: {date: value}}}}`
+    responses covering consecutive date windows into one response of the same
+    shape. A segment missing from some windows has no value for their dates:
+    it may have been left out of a window's top segments rather than have
+    had no events, so it is not given a 0.
+    """
+    series = []
+    values = collections.OrderedDict()
+    for response in responses:
+        data = response['data']
+        series.extend(data['series'])
+        for segment, by_date in six.iteritems(data['values']):
+            values.setdefault(segment, {}).update(by_date)
+
+    merged = dict(responses[0])
+    merged['data'] = dict(responses[0]['data'], series=series, values=dict(values))
+    if 'legend_size' in merged:
+        merged['legend_size'] = len(values)
+    return merged
+
+def _split_series_by_day(response, days):
+    """
+    Split a `{'data': {'series': [...], 'values': {segment: {date: value}}}}`
+    response into `{day: response}`, one response of the same shape for each
+    of `days` (yyyy-mm-dd), holding the dates (or hours) of that day.
+    """
+    records = dict((day, {'data': {'series': [], 'values': {}}}) for day in days)
+    data = response['data']
+    for date in data['series']:
+        if date[:10] in records:
+            records[date[:10]]['data']['series'].append(date)
+    for segment, by_date in six.iteritems(data['values']):
+        for date, value in six.iteritems(by_date):
+            if date[:10] in records:
+                records[date[:10]]['data']['values'].setdefault(segment, {})[date] = value
+    for record in six.itervalues(records):
+        record['legend_size'] = len(record['data']['values'])
+    return records
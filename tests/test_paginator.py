@@ -0,0 +1,120 @@
+import sys
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.exceptions import PoolClosedException
+from mixpanel_query.paginator import ConcurrentPaginator
+
+
+class FakeEngageClient(MixpanelQueryClient):
+    """
+    Serves `total` fake profiles in pages of `page_size`, recording the
+    highest number of page requests in flight at once.
+    """
+
+    def __init__(self, total=100, page_size=10, latency=0.02, **kwargs):
+        super(FakeEngageClient, self).__init__('key', 'secret', **kwargs)
+        self.total = total
+        self.page_size = page_size
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def get_engage(self, where=None, session_id=None, page=0, response_format=MixpanelQueryClient.FORMAT_JSON):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        first = page * self.page_size
+        return {
+            'page': page,
+            'page_size': self.page_size,
+            'results': list(range(first, min(first + self.page_size, self.total))),
+            'session_id': 'session',
+            'total': self.total,
+        }
+
+
+class ConcurrentPaginatorTest(unittest.TestCase):
+
+    def test_fetch_all_honors_concurrency_on_shared_executor(self):
+        with FakeEngageClient(max_workers=10) as client:
+            with ConcurrentPaginator(client.get_engage, concurrency=2) as paginator:
+                self.assertEqual(paginator.fetch_all(), list(range(client.total)))
+            self.assertEqual(client.max_in_flight, 2)
+
+    def test_iter_all_honors_concurrency_on_shared_executor(self):
+        with FakeEngageClient(max_workers=10) as client:
+            with ConcurrentPaginator(client.get_engage, concurrency=2) as paginator:
+                self.assertEqual(list(paginator.iter_all()), list(range(client.total)))
+            self.assertEqual(client.max_in_flight, 2)
+
+    def test_uses_client_executor_after_close(self):
+        client = FakeEngageClient(max_workers=4, latency=0)
+        paginator = ConcurrentPaginator(client.get_engage, concurrency=2)
+        self.assertEqual(len(paginator.fetch_all()), client.total)
+        client.close()
+        self.assertEqual(len(paginator.fetch_all()), client.total)
+        self.assertEqual(len(list(paginator.iter_all())), client.total)
+        client.close()
+
+    def test_closing_client_stops_running_iterations(self):
+        client = FakeEngageClient(latency=0)
+        iterator = ConcurrentPaginator(client.get_engage, concurrency=2).iter_all()
+        self.assertEqual(next(iterator), 0)
+        client.close()
+        with self.assertRaises(PoolClosedException):
+            list(iterator)
+        self.assertEqual(len(ConcurrentPaginator(client.get_engage, concurrency=2).fetch_all()), client.total)
+        client.close()
+
+    def test_caller_pool_survives_close(self):
+        pool = ThreadPool(processes=2)
+        try:
+            paginator = ConcurrentPaginator(FakeEngageClient(latency=0).get_engage, concurrency=2, pool=pool)
+            self.assertEqual(len(paginator.fetch_all()), 100)
+            paginator.close()
+            self.assertEqual(len(paginator.fetch_all()), 100)
+            self.assertEqual(len(list(paginator.iter_all())), 100)
+            paginator.close()
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_growing_pool_keeps_earlier_iterations_running(self):
+        small = FakeEngageClient(total=30, page_size=10, latency=0)
+        big = FakeEngageClient(total=200, page_size=10, latency=0)
+        with ConcurrentPaginator(lambda **params: self._engage(small, big, **params), concurrency=8) as paginator:
+            iterator = paginator.iter_all({'where': 'small'})
+            self.assertEqual(next(iterator), 0)
+            self.assertEqual(len(paginator.fetch_all({'where': 'big'})), big.total)
+            self.assertEqual(list(iterator), list(range(1, small.total)))
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'requires asyncio.run')
+    def test_rejects_async_client_methods(self):
+        import asyncio
+        from mixpanel_query.async_client import AsyncMixpanelQueryClient
+
+        async def _run():
+            async with AsyncMixpanelQueryClient('key', 'secret') as client:
+                with self.assertRaises(TypeError):
+                    ConcurrentPaginator(client.get_engage)
+                with self.assertRaises(TypeError):
+                    with client:
+                        pass
+        asyncio.run(_run())
+
+    def _engage(self, small, big, where=None, **params):
+        return (small if where == 'small' else big).get_engage(**params)
+
+
+if __name__ == '__main__':
+    unittest.main()
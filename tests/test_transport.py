@@ -0,0 +1,121 @@
+import json
+import socket
+import sys
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib import request as url_request
+
+from mixpanel_query.auth import SecretAuth
+from mixpanel_query.client import MixpanelQueryClient
+from mixpanel_query.transport import HTTPTransport
+
+
+class DroppingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers the first request of each connection, then applies any later
+    annotation write but drops the connection instead of answering it, like
+    a server going away right after acting on a request.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.served = 0
+
+    def do_GET(self):
+        self.served += 1
+        if 'annotations/create' in self.path:
+            self.server.count_write()
+            if self.served > 1:
+                self.close_connection = True
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+        body = json.dumps({'error': False}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DroppingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), DroppingHandler)
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def count_write(self):
+        with self._lock:
+            self.writes += 1
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/api'.format(*self.server_address[:2])
+
+
+class WriteResendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = DroppingServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_write_is_not_resent_on_a_dropped_keep_alive_connection(self):
+        with MixpanelQueryClient('key', 'secret', auth_class=SecretAuth) as client:
+            client.connection.ENDPOINT = self.server.url
+            # leaves an idle keep-alive connection, whose next request gets dropped
+            client.annotations_list('2014-04-01', '2014-04-30')
+            client.annotation_create('2014-04-01 00:00:00', 'Launched v2.0')
+            client.annotation_create('2014-04-02 00:00:00', 'Launched v2.1')
+        self.assertEqual(self.server.writes, 2)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'requires asyncio.run')
+    def test_async_write_is_not_resent_on_a_dropped_keep_alive_connection(self):
+        import asyncio
+        from mixpanel_query.async_client import AsyncMixpanelQueryClient
+
+        async def _run():
+            async with AsyncMixpanelQueryClient('key', 'secret', auth_class=SecretAuth) as client:
+                client.connection.ENDPOINT = self.server.url
+                await client.annotations_list('2014-04-01', '2014-04-30')
+                await client.annotation_create('2014-04-01 00:00:00', 'Launched v2.0')
+                await client.annotation_create('2014-04-02 00:00:00', 'Launched v2.1')
+        asyncio.run(_run())
+        self.assertEqual(self.server.writes, 2)
+
+
+class TransportCloseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = DroppingServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_released_after_close_is_not_kept(self):
+        transport = HTTPTransport()
+        response = transport.open(url_request.Request(self.server.url + '/2.0/events'), timeout=5)
+        pool = transport._get_pool('http', '{0}:{1}'.format(*self.server.server_address[:2]))
+        transport.close()
+        response.read()
+        self.assertTrue(pool._idle.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()